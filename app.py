@@ -3,52 +3,561 @@ import re
 import time
 import threading
 import hashlib
+import json
+import uuid
+import multiprocessing
+import queue
+import pickle
+import shutil
+import bisect
+import cProfile
+import hmac
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from calendar import monthrange
-from ics import Calendar, Event
+from urllib.parse import urlsplit
+import click
 import pdfplumber
+import numpy as np
 import pandas as pd
-from flask import Flask, render_template, request, send_file, session, redirect, url_for
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from flask import (Flask, Request, Response, render_template, request, send_file, session, redirect, url_for, jsonify,
+                   g, before_render_template, template_rendered)
 import pytz
 import requests
+from requests.adapters import HTTPAdapter
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
 
 # Configurazione applicazione
 app = Flask(__name__)
 app.secret_key = "supersecretkey_prod_123!@#"
 
 # Cartelle di lavoro
-UPLOAD_FOLDER = "uploads"
 ICS_FOLDER = "calendars"
 DB_FOLDER = "database"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+CACHE_FOLDER = "cache"
+PDF_FOLDER = os.path.join(DB_FOLDER, "pdf")  # PDF caricati, per hash del contenuto
 os.makedirs(ICS_FOLDER, exist_ok=True)
 os.makedirs(DB_FOLDER, exist_ok=True)
+os.makedirs(CACHE_FOLDER, exist_ok=True)
+os.makedirs(PDF_FOLDER, exist_ok=True)
+
+# Caricamenti: dimensione massima e firma iniziale dei PDF (cercata nei primi 1024 byte)
+MAX_UPLOAD_MB = int(os.environ.get("MAX_UPLOAD_MB", 20))
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_MB * 1024 * 1024
+PDF_MAGIC = b"%PDF-"
+PDF_HEADER_WINDOW = 1024
+
+# Cache dei risultati di sessione: LRU con scadenza, limite di voci e di byte.
+# Con `spill_dir` ogni voce è scritta anche su disco, dove la trovano gli altri worker
+# e da dove viene ricaricata dopo essere stata espulsa dalla memoria.
+class ResultCache:
+    def __init__(self, max_items, max_bytes, ttl, spill_dir=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.spill_dir = spill_dir
+        self.entries = OrderedDict()  # chiave -> (scadenza, byte, valore)
+        self.bytes = 0
+        self.counters = {"hit": 0, "hit_disco": 0, "miss": 0, "espulsi": 0, "scaduti": 0}
+        self.lock = threading.Lock()
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+
+    @staticmethod
+    def _size(value):
+        return sum(len(v) if isinstance(v, (str, bytes)) else 64 for v in value.values())
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, f"{hashlib.md5(key.encode()).hexdigest()}.pkl")
+
+    def _remove(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.bytes -= size
+
+    def _insert(self, key, value, expires):
+        if key in self.entries:
+            self._remove(key)
+        size = self._size(value)
+        self.entries[key] = (expires, size, value)
+        self.bytes += size
+        while self.entries and (len(self.entries) > self.max_items or self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.counters["espulsi"] += 1
+
+    def set(self, key, value):
+        expires = time.time() + self.ttl
+        with self.lock:
+            self._insert(key, value, expires)
+        if self.spill_dir:
+            path = self._spill_path(key)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((expires, value), f)
+            os.replace(tmp_path, path)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self.entries.move_to_end(key)
+                    self.counters["hit"] += 1
+                    return entry[2]
+                self._remove(key)
+                self.counters["scaduti"] += 1
+        if self.spill_dir:
+            try:
+                with open(self._spill_path(key), "rb") as f:
+                    expires, value = pickle.load(f)
+            except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+                expires = None
+            if expires is not None and expires > now:
+                with self.lock:
+                    self._insert(key, value, expires)
+                    self.counters["hit_disco"] += 1
+                return value
+        with self.lock:
+            self.counters["miss"] += 1
+        return None
+
+    # Rimozione delle voci scadute, in memoria e su disco
+    def purge_expired(self):
+        now = time.time()
+        with self.lock:
+            for key in [k for k, (expires, _, _) in self.entries.items() if expires <= now]:
+                self._remove(key)
+                self.counters["scaduti"] += 1
+        if self.spill_dir:
+            for name in os.listdir(self.spill_dir):
+                path = os.path.join(self.spill_dir, name)
+                try:
+                    if now - os.stat(path).st_mtime > self.ttl:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, voci=len(self.entries), byte=self.bytes,
+                        max_voci=self.max_items, max_byte=self.max_bytes, ttl=self.ttl,
+                        disco=bool(self.spill_dir))
 
 # Timezone e storage temporaneo
 TZ = pytz.timezone("Europe/Rome")
-TEMPORARY_STORAGE = {}
 CLEANUP_INTERVAL = 3600  # 1 ora
+TEMPORARY_STORAGE = ResultCache(
+    max_items=int(os.environ.get("RESULT_CACHE_ITEMS", 64)),
+    max_bytes=int(os.environ.get("RESULT_CACHE_MB", 64)) * 1024 * 1024,
+    ttl=CLEANUP_INTERVAL * 2,
+    spill_dir=os.environ.get("RESULT_CACHE_DIR") or None,  # es. cache/risultati con più worker gunicorn
+)
+
+# Coda lavori di elaborazione PDF. Coda, limiti e deduplica per hash valgono per processo: con più
+# worker gunicorn impostare JOBS_DIR (cartella condivisa, es. cache/lavori) perché lo stato dei lavori
+# sia visibile a tutti i worker che ricevono il polling di /jobs/<id>
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))        # elaborazioni contemporanee
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", 8))  # lavori in attesa oltre a quelli attivi
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", os.cpu_count() or 1))  # processi per l'estrazione delle pagine
+JOBS_DIR = os.environ.get("JOBS_DIR") or None
+if JOBS_DIR:
+    os.makedirs(JOBS_DIR, exist_ok=True)
+JOB_ID_RE = re.compile(r"[0-9a-f]{32}")
+JOBS = {}
+ACTIVE_JOBS_BY_HASH = {}
+JOBS_LOCK = threading.Lock()
+JOB_SLOTS = threading.BoundedSemaphore(JOB_WORKERS + JOB_QUEUE_SIZE)
+_POOLS_LOCK = threading.Lock()
+_job_executor = None
+_process_pool = None
+
+# Storico revisioni per mese: database/<Mese>-<Anno>/storico/<hash>.parquet + manifest
+HISTORY_FOLDER = "storico"
+HISTORY_MANIFEST = "_manifest.json"  # il prefisso "_" lo esclude dalle letture pyarrow della cartella
+LEGACY_HISTORY_FILE = "storico.parquet"
+MIGRATED_HISTORY_SUFFIX = ".migrato"  # file unico già migrato: conservato come copia, mai riletto
+
+# Archivio turni in memoria: una voce per cartella database/<Mese>-<Anno>
+ROSTER_STORE = {}
+ROSTER_LOCK = threading.Lock()
+
+# Catalogo dei mesi disponibili (database/catalogo.json)
+CATALOG_FILE = "catalogo.json"
+MONTH_CATALOG = {"versione": None, "mesi": {}}
+CATALOG_LOCK = threading.Lock()
+
+# API RapidAPI (URL configurabili per puntare a server di prova locali)
+RAPIDAPI_KEY = os.environ.get("RAPIDAPI_KEY", "db837ae358msh61f8796d5b31c86p1931e4jsn4ccd24caeeaf")
+FLIGHTRADAR1_URL = os.environ.get("FLIGHTRADAR1_URL", "https://flight-radar1.p.rapidapi.com")
+AIRCRAFTSCATTER_URL = os.environ.get("AIRCRAFTSCATTER_URL", "https://aircraftscatter.p.rapidapi.com")
+FLIGHTRADAR24_URL = os.environ.get("FLIGHTRADAR24_URL", "https://fligtradar24-data.p.rapidapi.com")
+HTTP_TIMEOUT = (float(os.environ.get("HTTP_CONNECT_TIMEOUT", 3.05)), float(os.environ.get("HTTP_READ_TIMEOUT", 10)))
+FLIGHT_SEARCH_TTL = 300  # secondi
+
+# Istantanea AircraftScatter dell'area FCO, indicizzata per callsign
+SCATTER_URL_PATH = "/lat/41.800278/lon/12.238889/"
+SCATTER_REFRESH_INTERVAL = float(os.environ.get("SCATTER_REFRESH_INTERVAL", 20))  # secondi
+SCATTER_STALE_AFTER = SCATTER_REFRESH_INTERVAL * 3
+SCATTER_INDEX = {"per_callsign": {}, "aggiornato": None, "errore": None}
+SCATTER_LOCK = threading.Lock()
+_scatter_thread = None
+
+# Tabellone arrivi FCO: un solo poller aggiorna la lista e la invia ai client SSE
+ARRIVALS_URL_PATH = "/v1/airports/arrivals"
+ARRIVALS_PARAMS = {"limit": "40", "page": "1", "code": "fco"}
+ARRIVALS_REFRESH_INTERVAL = float(os.environ.get("ARRIVALS_REFRESH_INTERVAL", 60))  # secondi
+ARRIVALS_KEEPALIVE = 15
+ARRIVALS_STATE = {"arrivi": [], "versione": 0, "aggiornato": None, "errore": None}
+ARRIVALS_SUBSCRIBERS = set()
+ARRIVALS_LOCK = threading.Lock()
+_arrivals_thread = None
+
+# Sessione HTTP condivisa (connessioni keep-alive) e cache delle risposte
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+HTTP_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+API_CACHE = {}
+API_INFLIGHT = {}
+API_LOCK = threading.Lock()
+
+# Tempi per fase: istogrammi cumulativi esposti su /metrics (formato testo Prometheus)
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # secondi
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+
+# Profilo cProfile di una singola richiesta con l'header "X-Profile: <PROFILE_TOKEN>"
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_FOLDER = os.path.join(CACHE_FOLDER, "profili")
+
+def observe(stage, seconds):
+    with METRICS_LOCK:
+        histogram = METRICS.get(stage)
+        if histogram is None:
+            histogram = METRICS[stage] = {"bucket": [0] * len(METRICS_BUCKETS), "somma": 0.0, "conteggio": 0}
+        i = bisect.bisect_left(METRICS_BUCKETS, seconds)
+        if i < len(METRICS_BUCKETS):
+            histogram["bucket"][i] += 1
+        histogram["somma"] += seconds
+        histogram["conteggio"] += 1
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
 
 # Pulizia storage
 def storage_cleanup():
     while True:
         time.sleep(CLEANUP_INTERVAL)
         now = time.time()
-        expired = [k for k, v in TEMPORARY_STORAGE.items() if now - v['timestamp'] > CLEANUP_INTERVAL * 2]
-        for key in expired:
-            del TEMPORARY_STORAGE[key]
+        TEMPORARY_STORAGE.purge_expired()
+        with JOBS_LOCK:
+            expired_jobs = [k for k, v in JOBS.items()
+                            if v["stato"] in ("completato", "errore") and now - v["aggiornato"] > CLEANUP_INTERVAL * 2]
+            for key in expired_jobs:
+                del JOBS[key]
+        if JOBS_DIR:
+            for entry in os.scandir(JOBS_DIR):
+                if entry.name.endswith(".json") and now - entry.stat().st_mtime > CLEANUP_INTERVAL * 2:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
 
 cleanup_thread = threading.Thread(target=storage_cleanup)
 cleanup_thread.daemon = True
 cleanup_thread.start()
 
-# Calcolo hash file
-def file_hash(filepath, block_size=65536):
-    hasher = hashlib.md5()
-    with open(filepath, 'rb') as f:
-        for block in iter(lambda: f.read(block_size), b''):
-            hasher.update(block)
-    return hasher.hexdigest()
+# GET JSON con cache TTL: richieste identiche contemporanee attendono un'unica chiamata
+def fetch_json(url, headers, params=None, ttl=60):
+    key = (url, tuple(sorted((params or {}).items())))
+    with API_LOCK:
+        now = time.monotonic()
+        cached = API_CACHE.get(key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        future = API_INFLIGHT.get(key)
+        leader = future is None
+        if leader:
+            future = Future()
+            API_INFLIGHT[key] = future
+    if not leader:
+        return future.result()
+
+    try:
+        with timed(f"api {urlsplit(url).netloc}"):
+            res = HTTP_SESSION.get(url, headers=headers, params=params, timeout=HTTP_TIMEOUT)
+            res.raise_for_status()
+            data = res.json()
+        with API_LOCK:
+            now = time.monotonic()
+            for k in [k for k, v in API_CACHE.items() if v[0] <= now]:
+                del API_CACHE[k]
+            API_CACHE[key] = (now + ttl, data)
+        future.set_result(data)
+        return data
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with API_LOCK:
+            API_INFLIGHT.pop(key, None)
+
+def rapidapi_headers(base_url):
+    return {
+        "x-rapidapi-key": RAPIDAPI_KEY,
+        "x-rapidapi-host": base_url.split("://", 1)[-1].split("/", 1)[0]
+    }
+
+# Aggiornamento dell'indice callsign -> aeromobile
+def refresh_scatter_index():
+    data = fetch_json(f"{AIRCRAFTSCATTER_URL}{SCATTER_URL_PATH}", rapidapi_headers(AIRCRAFTSCATTER_URL), ttl=0)
+    per_callsign = {}
+    for ac in data.get("ac", []):
+        # Aeromobili senza callsign (assente, null o vuoto) non sono indicizzati
+        callsign = ac.get("flight")
+        callsign = callsign.strip().upper() if isinstance(callsign, str) else ""
+        if callsign:
+            per_callsign.setdefault(callsign, ac)
+    with SCATTER_LOCK:
+        SCATTER_INDEX.update(per_callsign=per_callsign, aggiornato=time.time(), errore=None)
+
+def scatter_refresher():
+    while True:
+        try:
+            refresh_scatter_index()
+        except Exception as e:
+            print(f"Aggiornamento AircraftScatter fallito: {e}")
+            with SCATTER_LOCK:
+                SCATTER_INDEX["errore"] = str(e)
+        time.sleep(SCATTER_REFRESH_INTERVAL)
+
+def ensure_scatter_refresher():
+    global _scatter_thread
+    with SCATTER_LOCK:
+        if _scatter_thread is None:
+            _scatter_thread = threading.Thread(target=scatter_refresher, daemon=True)
+            _scatter_thread.start()
+
+# Indice corrente e la sua età in secondi; aggiornato subito se assente o troppo vecchio
+def get_scatter_snapshot():
+    ensure_scatter_refresher()
+    with SCATTER_LOCK:
+        aggiornato = SCATTER_INDEX["aggiornato"]
+    if aggiornato is None or time.time() - aggiornato > SCATTER_STALE_AFTER:
+        try:
+            refresh_scatter_index()
+        except Exception:
+            if aggiornato is None:
+                raise
+    with SCATTER_LOCK:
+        return SCATTER_INDEX["per_callsign"], time.time() - SCATTER_INDEX["aggiornato"]
+
+# Conversione timestamp Unix -> HH:MM
+def format_epoch(epoch):
+    try:
+        return datetime.fromtimestamp(epoch).strftime("%H:%M")
+    except (TypeError, ValueError, OverflowError, OSError):
+        return "N/D"
+
+# Estrazione della lista arrivi dalla risposta fligtradar24
+def parse_arrivals(data):
+    airport_data = data.get("data", {}).get("airport")
+    if not airport_data:
+        raise ValueError("❌ 'airport' mancante nella risposta")
+
+    plugin_data = airport_data.get("pluginData", {})
+    arrivals_data = plugin_data.get("schedule", {}).get("arrivals", {})
+
+    arrivi = []
+    for item in arrivals_data.get("data", []):
+        flight = item.get("flight", {})
+
+        flight_number = (flight.get("identification") or {}).get("number", {}).get("default", "N/D")
+        if not flight_number or flight_number == "N/D":
+            continue
+
+        time_data = flight.get("time", {})
+        orario_sched_arr_epoch = time_data.get("scheduled", {}).get("arrival")
+        orario_real_arr_epoch = time_data.get("real", {}).get("arrival")
+        orario_sched_arr = format_epoch(orario_sched_arr_epoch) if orario_sched_arr_epoch else "N/D"
+
+        arrivi.append({
+            "id": f"{flight_number}-{orario_sched_arr_epoch or ''}",
+            "compagnia": (flight.get("airline") or {}).get("name", "N/D"),
+            "flight_number": flight_number,
+            "provenienza": (flight.get("airport") or {}).get("origin", {}).get("position", {}).get("region", {}).get("city", "N/D"),
+            "orario_sched_arr": orario_sched_arr,
+            "orario_real_arr": format_epoch(orario_real_arr_epoch) if orario_real_arr_epoch else "N/D",
+            "stato_testo": (flight.get("status") or {}).get("text", "N/D"),
+            "colore": (flight.get("status") or {}).get("icon", "grey"),
+            "logo": (flight.get("owner") or {}).get("logo", ""),
+            "terminal": (flight.get("airport") or {}).get("destination", {}).get("info", {}).get("terminal", "N/D")
+        })
+    return arrivi
+
+# Differenze tra due liste arrivi, per id
+def diff_arrivals(vecchi, nuovi):
+    prima = {a["id"]: a for a in vecchi}
+    dopo = {a["id"]: a for a in nuovi}
+    return {
+        "aggiunti": [a for a in nuovi if a["id"] not in prima],
+        "modificati": [a for a in nuovi if a["id"] in prima and prima[a["id"]] != a],
+        "rimossi": [k for k in prima if k not in dopo],
+        "ordine": [a["id"] for a in nuovi]
+    }
+
+# Consegna di un evento a tutti i client SSE; chi non legge da troppo viene scollegato
+def publish_arrivals(evento):
+    for coda in list(ARRIVALS_SUBSCRIBERS):
+        try:
+            coda.put_nowait(evento)
+        except queue.Full:
+            ARRIVALS_SUBSCRIBERS.discard(coda)
+            with coda.mutex:
+                coda.queue.clear()
+            coda.put_nowait(None)
+
+def refresh_arrivals():
+    data = fetch_json(f"{FLIGHTRADAR24_URL}{ARRIVALS_URL_PATH}", rapidapi_headers(FLIGHTRADAR24_URL), ARRIVALS_PARAMS, ttl=0)
+    arrivi = parse_arrivals(data)
+    with ARRIVALS_LOCK:
+        diff = diff_arrivals(ARRIVALS_STATE["arrivi"], arrivi)
+        cambiato = diff["aggiunti"] or diff["modificati"] or diff["rimossi"] or diff["ordine"] != [a["id"] for a in ARRIVALS_STATE["arrivi"]]
+        ARRIVALS_STATE.update(aggiornato=time.time(), errore=None)
+        if cambiato or ARRIVALS_STATE["versione"] == 0:
+            ARRIVALS_STATE["arrivi"] = arrivi
+            ARRIVALS_STATE["versione"] += 1
+            diff["versione"] = ARRIVALS_STATE["versione"]
+            publish_arrivals(diff)
+
+def arrivals_poller():
+    while True:
+        try:
+            refresh_arrivals()
+        except Exception as e:
+            print(f"❌ ERRORE aggiornamento arrivi: {e}")
+            with ARRIVALS_LOCK:
+                ARRIVALS_STATE["errore"] = str(e)
+        time.sleep(ARRIVALS_REFRESH_INTERVAL)
+
+def ensure_arrivals_poller():
+    global _arrivals_thread
+    with ARRIVALS_LOCK:
+        if _arrivals_thread is None:
+            _arrivals_thread = threading.Thread(target=arrivals_poller, daemon=True)
+            _arrivals_thread.start()
+
+# Lista arrivi corrente e sua versione; al primo accesso attende il primo aggiornamento
+def get_arrivals():
+    ensure_arrivals_poller()
+    with ARRIVALS_LOCK:
+        pronto = ARRIVALS_STATE["aggiornato"] is not None
+    if not pronto:
+        refresh_arrivals()
+    with ARRIVALS_LOCK:
+        return ARRIVALS_STATE["arrivi"], ARRIVALS_STATE["versione"]
+
+# Percorso del PDF nell'archivio per contenuto
+def pdf_store_path(pdf_hash):
+    return os.path.join(PDF_FOLDER, f"{pdf_hash}.pdf")
+
+# File caricato scritto direttamente nell'archivio PDF: hash e controllo della firma durante lo streaming
+class PdfUpload:
+    def __init__(self):
+        self.part_path = os.path.join(PDF_FOLDER, f".{uuid.uuid4().hex}.part")
+        self.file = open(self.part_path, "w+b")
+        self.hasher = hashlib.md5()
+        self.header = b""
+        self.committed = False
+        self.nuovo = False  # True se il commit ha aggiunto il file all'archivio
+
+    def write(self, data):
+        if len(self.header) < PDF_HEADER_WINDOW:
+            self.header += data[:PDF_HEADER_WINDOW - len(self.header)]
+            if len(self.header) == PDF_HEADER_WINDOW and PDF_MAGIC not in self.header:
+                self.discard()
+                raise UnsupportedMediaType("Il file caricato non è un PDF")
+        self.hasher.update(data)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    # Rinomina il file con il suo hash (se già presente si tiene quello esistente)
+    def commit(self):
+        self.file.close()
+        if PDF_MAGIC not in self.header:
+            self.discard()
+            raise UnsupportedMediaType("Il file caricato non è un PDF")
+        pdf_hash = self.hasher.hexdigest()
+        pdf_path = pdf_store_path(pdf_hash)
+        if os.path.exists(pdf_path):
+            os.remove(self.part_path)
+        else:
+            os.replace(self.part_path, pdf_path)
+            self.nuovo = True
+        self.committed = True
+        return pdf_path, pdf_hash
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.part_path):
+            os.remove(self.part_path)
+
+    def close(self):
+        if self.committed:
+            self.file.close()
+        else:
+            self.discard()
+
+# Richiesta con i file caricati in streaming verso l'archivio PDF (nessun file temporaneo intermedio)
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        upload = PdfUpload()
+        self.__dict__.setdefault("_pdf_uploads", []).append(upload)
+        return upload
+
+    def close(self):
+        super().close()
+        for upload in self.__dict__.get("_pdf_uploads", []):
+            upload.close()
+
+app.request_class = UploadRequest
+
+# Cache persistente delle elaborazioni PDF (chiave: hash del contenuto)
+def parse_cache_path(pdf_hash):
+    return os.path.join(CACHE_FOLDER, f"{pdf_hash}.pkl")
+
+def load_parse_cache(pdf_hash):
+    path = parse_cache_path(pdf_hash)
+    if not os.path.exists(path):
+        return None
+    try:
+        return pd.read_pickle(path)
+    except Exception as e:
+        print(f"Cache non leggibile per {pdf_hash}: {str(e)}")
+        return None
+
+def store_parse_cache(pdf_hash, entry):
+    path = parse_cache_path(pdf_hash)
+    tmp_path = _tmp_path(path)
+    pd.to_pickle(entry, tmp_path)
+    os.replace(tmp_path, path)
 
 # Estrazione mese e anno
 def extract_month_year_from_table(df):
@@ -70,108 +579,1088 @@ def extract_month_year_from_table(df):
                     return months_map[mese_abbr], int(anno)
     return None, None
 
-# Estrazione tabella
-def extract_table_from_pdf(pdf_path):
-    tables = []
+# Suddivisione di n pagine in gruppi contigui
+def _split_range(n, parts):
+    size, extra = divmod(n, parts)
+    start = 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        yield range(start, end)
+        start = end
+
+# Estrazione tabelle da un gruppo di pagine (None = tutte), eseguita nel pool di processi;
+# restituisce anche i tempi, registrati poi dal processo principale
+def extract_page_tables(pdf_path, page_numbers=None):
+    start = time.perf_counter()
     with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            table = page.extract_table()
-            if table:
-                df = pd.DataFrame(table).dropna(axis=0, how="all").dropna(axis=1, how="all")
-                tables.append(df)
+        pages = pdf.pages
+        open_seconds = time.perf_counter() - start
+        tables, page_seconds = [], []
+        for n in range(len(pages)) if page_numbers is None else page_numbers:
+            start = time.perf_counter()
+            tables.append(pages[n].extract_table())
+            page_seconds.append(time.perf_counter() - start)
+    return tables, open_seconds, page_seconds
+
+def pdf_page_count(pdf_path):
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+# Estrazione tabella: sempre nel pool di processi (pdfplumber trattiene il GIL e rallenterebbe le
+# route del processo web), tranne quando si è già in un processo del pool
+def extract_table_from_pdf(pdf_path, workers=None, progress=None):
+    workers = PDF_WORKERS if workers is None else workers
+    if multiprocessing.parent_process() is not None:
+        raw_tables = extract_page_tables(pdf_path)[0]  # già in un processo del pool
+    else:
+        pool = get_process_pool()
+        if workers > 1:
+            # Pagine contate in un processo del pool, poi gruppi contigui riassemblati nell'ordine originale
+            num_pages = pool.submit(pdf_page_count, pdf_path).result()
+            chunks = [list(c) for c in _split_range(num_pages, max(1, min(workers, num_pages)))]
+        else:
+            chunks = [None]
+            num_pages = None
+        futures = {pool.submit(extract_page_tables, pdf_path, chunk): i for i, chunk in enumerate(chunks)}
+        results = [None] * len(chunks)
+        done_pages = 0
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i], open_seconds, page_seconds = future.result()
+            observe("pdf apertura", open_seconds)
+            for seconds in page_seconds:
+                observe("pdf pagina", seconds)
+            done_pages += len(page_seconds)
+            if progress:
+                progress(done_pages, num_pages or done_pages)
+        raw_tables = [table for chunk_tables in results for table in chunk_tables]
+
+    tables = []
+    for table in raw_tables:
+        if table:
+            df = pd.DataFrame(table).dropna(axis=0, how="all").dropna(axis=1, how="all")
+            tables.append(df)
     return pd.concat(tables, ignore_index=True) if tables else None
 
-# Traduzione turni
+# Codici turno
+WORK_HOURS = {"d": 4, "e": 5, "f": 6, "g": 7, "h": 8}
+SPECIAL_EVENTS = {"R1", "R2", "FER", "R0", "OFF", "FEST"}
+
+# Ricerca cambio turno: chi è in riposo/ferie nel giorno richiesto non viene proposto
+SWAP_EXCLUDED_CODES = {"R1", "FER", "OFF"}
+SWAP_MODES = ("esatto", "compatibile", "sovrapposto")
+SWAP_MAX_WINDOW = 31           # giorni
+SWAP_DAY_PENALTY = 60          # punteggio per giorno di distanza (pari a un'ora di scarto d'inizio)
+SWAP_HOUR_PENALTY = 30         # punteggio per ora di differenza di durata
+SWAP_RESULT_LIMIT = 200        # candidati mostrati nella pagina
+
+# Traduzione di una singola cella già normalizzata (usata per i casi limite)
+def translate_shift_code(clean_value):
+    if clean_value in SPECIAL_EVENTS:
+        return clean_value.upper()
+    if len(clean_value) >= 2 and clean_value[0] in WORK_HOURS:
+        number_part = re.sub(r'[^0-9]', '', clean_value[1:])
+        if not number_part:
+            return clean_value.upper()
+        try:
+            start_code = int(number_part)
+            duration = WORK_HOURS[clean_value[0]]
+            start_h = start_code / 2
+            start_time = f"{int(start_h):02d}:{'00' if start_h % 1 == 0 else '30'}"
+            return f"{start_time} ({duration})"
+        except:
+            return "Formato non valido"
+    return clean_value.upper()
+
+# Decodifica vettoriale dei codici grezzi ("" per le celle vuote)
+def decode_shift_codes(raw):
+    clean = raw.str.strip().str.lower().str.replace(r"[^a-z0-9]", "", regex=True)
+
+    # Di default il codice in maiuscolo (R1, FER, OFF...)
+    decoded = clean.str.upper()
+
+    # Turni lavorativi: prefisso d-h seguito dal codice orario
+    prefix = clean.str[0]
+    is_work = (clean.str.len() >= 2) & prefix.isin(list(WORK_HOURS))
+    digits = clean[is_work].str[1:].str.replace(r"[^0-9]", "", regex=True)
+    digits = digits[digits != ""]
+    fast = digits[digits.str.len() <= 15]  # conversione esatta in int64
+    if not fast.empty:
+        start_code = fast.astype(np.int64)
+        hours = (start_code // 2).astype(str).str.zfill(2)
+        minutes = pd.Series(np.where(start_code % 2 == 0, "00", "30"), index=fast.index)
+        durations = prefix[fast.index].map(WORK_HOURS).astype(str)
+        decoded[fast.index] = hours + ":" + minutes + " (" + durations + ")"
+    for i in digits.index.difference(fast.index):
+        decoded[i] = translate_shift_code(clean[i])
+    return decoded
+
+# Traduzione turni (operazioni vettoriali sull'intero blocco dei giorni)
 def translate_shifts(df, month, year):
-    work_hours = {"d": 4, "e": 5, "f": 6, "g": 7, "h": 8}
-    special_events = {"R1", "R2", "FER", "R0", "OFF", "FEST"}
     month_number = datetime.strptime(month, "%B").month
     _, num_days = monthrange(year, month_number)
-    days = list(range(1, num_days + 1))
-    pivot_data = {}
-
-    for idx, row in df.iterrows():
-        if idx == 0:
+    days = [str(day) for day in range(1, num_days + 1)]
+    cols = ["Nome"] + days
+
+    # Righe dei colleghi: esclusa l'intestazione, nome testuale
+    rows = df[df.index != 0]
+    rows = rows[rows.iloc[:, 0].map(lambda v: isinstance(v, str))]
+    if rows.empty:
+        empty_df = pd.DataFrame(columns=cols, dtype=object)
+        empty_df.columns.name = "Giorno"
+        return empty_df
+    nomi = rows.iloc[:, 0].str.split(",").str[0].str.strip()
+
+    # Le celle distinte sono poche: si decodificano solo i valori unici
+    block = rows.iloc[:, 1:num_days + 1]
+    cells = pd.Series(block.to_numpy().ravel(), dtype=object)
+    text = cells.astype(str).where(cells.notna(), "")
+    codes, uniques = pd.factorize(text.to_numpy())
+    decoded = decode_shift_codes(pd.Series(uniques, dtype=object)).to_numpy()
+    decoded[decoded == ""] = np.nan
+    grid = pd.DataFrame(decoded[codes].reshape(block.shape), columns=days[:block.shape[1]])
+
+    # Nomi ripetuti: vale l'ultimo valore non vuoto per ogni giorno
+    translated_df = grid.groupby(nomi.to_numpy(), sort=False).last()
+    translated_df = translated_df.reindex(columns=days).fillna("")
+    translated_df.columns.name = "Giorno"
+    translated_df.index.name = "Nome"
+    translated_df.reset_index(inplace=True)
+    return translated_df[cols]
+
+# Scrittura diretta dei calendari ICS (RFC 5545) in ora locale Europe/Rome
+ICS_PRODID = "Analisi Griglia PDF"
+ICS_VTIMEZONE = [
+    "BEGIN:VTIMEZONE",
+    "TZID:Europe/Rome",
+    "BEGIN:DAYLIGHT",
+    "TZOFFSETFROM:+0100",
+    "TZOFFSETTO:+0200",
+    "TZNAME:CEST",
+    "DTSTART:19700329T020000",
+    "RRULE:FREQ=YEARLY;BYMONTH=3;BYDAY=-1SU",
+    "END:DAYLIGHT",
+    "BEGIN:STANDARD",
+    "TZOFFSETFROM:+0200",
+    "TZOFFSETTO:+0100",
+    "TZNAME:CET",
+    "DTSTART:19701025T030000",
+    "RRULE:FREQ=YEARLY;BYMONTH=10;BYDAY=-1SU",
+    "END:STANDARD",
+    "END:VTIMEZONE",
+]
+SHIFT_VALUE_RE = re.compile(r"^(\d{2}):(\d{2}) \((\d+)\)$")
+
+def _ics_escape(text):
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+# Righe più lunghe di 75 ottetti spezzate come da RFC 5545
+def _ics_fold(line):
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line
+    parts = []
+    while data:
+        size = 75 if not parts else 74
+        while size < len(data) and (data[size] & 0xC0) == 0x80:
+            size -= 1  # non spezzare un carattere UTF-8
+        parts.append(data[:size].decode("utf-8"))
+        data = data[size:]
+    return "\r\n ".join(parts)
+
+def _ics_local(dt):
+    return f"{dt.year:04d}{dt.month:02d}{dt.day:02d}T{dt.hour:02d}{dt.minute:02d}00"
+
+# DTSTART/DTEND/SUMMARY di una cella tradotta, None se non corrisponde a un evento
+# Memorizzati tra le chiamate: gli stessi (giorno, turno) ricorrono per molte persone e revisioni
+@lru_cache(maxsize=8192)
+def ics_event_fields(year, month_number, day, value):
+    if value in SPECIAL_EVENTS:
+        date = f"{year:04d}{month_number:02d}{day:02d}"
+        return (f"DTSTART;TZID={TZ.zone}:{date}T000100",
+                f"DTEND;TZID={TZ.zone}:{date}T235900",
+                f"SUMMARY:{value}")
+    match = SHIFT_VALUE_RE.match(value)
+    if not match:
+        return None
+    start_h, start_m, duration = map(int, match.groups())
+    if start_h > 23 or start_m > 59:
+        return None
+    begin = datetime(year, month_number, day, start_h, start_m)
+    # Fine calcolata in tempo assoluto: corretta anche nei giorni di cambio ora
+    end = TZ.normalize(TZ.localize(begin) + timedelta(hours=duration))
+    return (f"DTSTART;TZID={TZ.zone}:{_ics_local(begin)}",
+            f"DTEND;TZID={TZ.zone}:{_ics_local(end)}",
+            f"SUMMARY:Turno: {start_h:02d}:{start_m:02d} ({duration}h)")
+
+# Un calendario per riga del frame tradotto, in un solo passaggio: genera (nome, testo ICS)
+def iter_ics_calendars(translated_df, month, year, dtstamp=None):
+    month_number = datetime.strptime(month, "%B").month
+    day_cols = [c for c in translated_df.columns if c.isdigit()]
+    days = [int(c) for c in day_cols]
+    stamp = (dtstamp or datetime.now(pytz.utc)).strftime("%Y%m%dT%H%M%SZ")
+    for nome, values in zip(translated_df["Nome"].to_numpy(), translated_df[day_cols].to_numpy()):
+        yield nome, person_ics_text(nome, days, values, month, month_number, year, stamp)
+
+# Testo ICS di una persona: turni `values` nei giorni `days` del mese
+def person_ics_text(nome, days, values, month, month_number, year, stamp):
+    uid_prefix = hashlib.md5(normalize_name(nome).encode()).hexdigest()[:16]
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODID}", "CALSCALE:GREGORIAN",
+             _ics_fold(f"X-WR-CALNAME:{_ics_escape(f'Turni {nome} {month} {year}')}"),
+             f"X-WR-TIMEZONE:{TZ.zone}"]
+    lines.extend(ICS_VTIMEZONE)
+    for day, value in zip(days, values):
+        if not isinstance(value, str) or not value:
             continue
-        nome_cell = row.iloc[0]
-        if pd.isna(nome_cell) or not isinstance(nome_cell, str):
+        fields = ics_event_fields(year, month_number, day, value)
+        if fields is None:
             continue
-        nome = nome_cell.split(",")[0].strip()
-        if nome not in pivot_data:
-            pivot_data[nome] = {str(day): "" for day in days}
-
-        for day in days:
-            if day >= len(row):
-                continue
-            raw_value = str(row.iloc[day]).strip().lower() if (day < len(row) and not pd.isna(row.iloc[day])) else ""
-            clean_value = re.sub(r'[^a-z0-9]', '', raw_value)
-            if not clean_value:
-                continue
-            if clean_value in special_events:
-                pivot_data[nome][str(day)] = clean_value.upper()
-            elif len(clean_value) >= 2 and clean_value[0] in work_hours:
-                prefix = clean_value[0]
-                number_part = re.sub(r'[^0-9]', '', clean_value[1:])
-                if number_part:
-                    try:
-                        start_code = int(number_part)
-                        duration = work_hours[prefix]
-                        start_h = start_code / 2
-                        start_time = f"{int(start_h):02d}:{'00' if start_h % 1 == 0 else '30'}"
-                        pivot_data[nome][str(day)] = f"{start_time} ({duration})"
-                    except:
-                        pivot_data[nome][str(day)] = "Formato non valido"
-                else:
-                    pivot_data[nome][str(day)] = clean_value.upper()
+        lines.append("BEGIN:VEVENT")
+        lines.append(f"UID:{uid_prefix}-{year:04d}{month_number:02d}{day:02d}@turni")
+        lines.append(f"DTSTAMP:{stamp}")
+        lines.extend(fields)
+        lines.append("END:VEVENT")
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(lines) + "\r\n"
+
+# Calendario personale generato alla prima richiesta e memorizzato per contenuto della riga:
+# una nuova revisione del mese rigenera solo i calendari delle persone con turni cambiati
+def person_shift_hash(roster, pos):
+    valori = [str(roster["nomi"][pos])] + roster["codici"][roster["matrice"][pos]].tolist()
+    return hashlib.md5("\x1f".join(valori).encode()).hexdigest()
+
+def person_ics_path(mese, anno, nome_norm, shift_hash):
+    nome_hash = hashlib.md5(nome_norm.encode()).hexdigest()
+    return os.path.join(ICS_FOLDER, f"{mese}-{anno}", f"{nome_hash[:16]}-{shift_hash[:16]}.ics")
+
+def get_person_ics(roster, nome_norm, mese, anno):
+    # Ultima revisione che contiene la persona
+    pos = roster["per_nome"][nome_norm][-1]
+    path = person_ics_path(mese, anno, nome_norm, person_shift_hash(roster, pos))
+    if not os.path.exists(path):
+        # Riga letta direttamente dalla matrice codificata, senza passare da un DataFrame
+        with timed("ics"):
+            text = person_ics_text(roster["nomi"][pos], [int(g) for g in roster["giorni"]],
+                                   roster["codici"][roster["matrice"][pos]].tolist(), mese,
+                                   datetime.strptime(mese, "%B").month, int(anno),
+                                   datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", newline="") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    etag = f"{mese}-{anno}-{os.path.basename(path)[:-4]}"
+    return path, etag
+
+# Codifica compatta dei turni: tabella dei codici (0 = cella vuota) e matrice int16 persona x giorno
+def encode_shifts(block):
+    values = block.to_numpy(dtype=object).ravel()
+    values = np.where([isinstance(v, str) for v in values], values, "")
+    codes, codici = pd.factorize(np.concatenate([[""], values]))
+    return codici.astype(object), codes[1:].astype(np.int16).reshape(block.shape)
+
+# Partizione Parquet: colonne dei giorni come dizionario Arrow con indici int16
+def history_table(df):
+    giorni = [c for c in df.columns if c.isdigit()]
+    codici, matrice = encode_shifts(df[giorni])
+    dizionario = pa.array(codici, pa.string())
+    columns = {c: pa.array(df[c].to_numpy(dtype=object), pa.string()) for c in df.columns if not c.isdigit()}
+    for j, giorno in enumerate(giorni):
+        columns[giorno] = pa.DictionaryArray.from_arrays(pa.array(matrice[:, j]), dizionario)
+    return pa.table({c: columns[c] for c in df.columns})
+
+# File temporaneo nascosto accanto a `path`, da rinominare con os.replace a scrittura finita
+def _tmp_path(path):
+    return os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+
+# Lock esclusivo sulla cartella del mese, valido anche tra processi diversi
+def month_lock(month_folder):
+    os.makedirs(month_folder, exist_ok=True)
+    return file_lock(os.path.join(month_folder, ".lock"))
+
+# Lock esclusivo tra processi su un file di lock
+@contextmanager
+def file_lock(lock_path):
+    with open(lock_path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
             else:
-                pivot_data[nome][str(day)] = clean_value.upper()
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
 
-    translated_df = pd.DataFrame.from_dict(pivot_data, orient="index")
-    translated_df.columns.name = "Giorno"
-    translated_df.index.name = "Nome"
-    translated_df.reset_index(inplace=True)
-    cols = ["Nome"] + [str(day) for day in days]
-    return translated_df[cols].fillna("")
+def history_manifest_path(month_folder):
+    return os.path.join(month_folder, HISTORY_FOLDER, HISTORY_MANIFEST)
 
-# Generazione file ICS
+# Revisioni del mese nell'ordine di caricamento
+def read_history_manifest(month_folder):
+    try:
+        with open(history_manifest_path(month_folder)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"revisioni": []}
+
+def _write_history_partition(month_folder, manifest, pdf_hash, df):
+    nome_file = f"{pdf_hash}.parquet"
+    path = os.path.join(month_folder, HISTORY_FOLDER, nome_file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = _tmp_path(path)
+    with timed("parquet scrittura"):
+        pq.write_table(history_table(df), tmp_path)
+    os.replace(tmp_path, path)
+    manifest["revisioni"].append({"hash": pdf_hash, "file": nome_file, "righe": len(df),
+                                  "caricato": datetime.now(TZ).isoformat(timespec="seconds")})
+
+def _write_history_manifest(month_folder, manifest):
+    path = history_manifest_path(month_folder)
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, path)
+
+# Conversione del vecchio storico.parquet unico in partizioni per hash (da chiamare con il lock);
+# il file originale resta accanto con il suffisso MIGRATED_HISTORY_SUFFIX
+def _migrate_legacy_history(month_folder):
+    legacy_path = os.path.join(month_folder, LEGACY_HISTORY_FILE)
+    if not os.path.exists(legacy_path):
+        return
+    manifest = read_history_manifest(month_folder)
+    presenti = {r["hash"] for r in manifest["revisioni"]}
+    for pdf_hash, df in pd.read_parquet(legacy_path).groupby("__HASH__", sort=False):
+        if pdf_hash not in presenti:
+            _write_history_partition(month_folder, manifest, pdf_hash, df)
+    _write_history_manifest(month_folder, manifest)
+    os.replace(legacy_path, legacy_path + MIGRATED_HISTORY_SUFFIX)
+
+def ensure_history(month_folder):
+    if os.path.exists(os.path.join(month_folder, LEGACY_HISTORY_FILE)):
+        with month_lock(month_folder):
+            _migrate_legacy_history(month_folder)
+
+# Aggiunta di revisioni [(hash, df)] (con il lock): scrive solo quelle nuove e il manifest una volta;
+# restituisce le righe totali del mese
+def _append_history_revisions(month_folder, revisioni):
+    _migrate_legacy_history(month_folder)
+    manifest = read_history_manifest(month_folder)
+    presenti = {r["hash"] for r in manifest["revisioni"]}
+    nuove = [(pdf_hash, df) for pdf_hash, df in revisioni if pdf_hash not in presenti]
+    for pdf_hash, translated_df in nuove:
+        _write_history_partition(month_folder, manifest, pdf_hash, translated_df)
+    if nuove:
+        _write_history_manifest(month_folder, manifest)
+    return sum(r["righe"] for r in manifest["revisioni"])
+
+def _append_history(month_folder, pdf_hash, translated_df):
+    return _append_history_revisions(month_folder, [(pdf_hash, translated_df)])
+
+def _history_files(month_folder):
+    return [os.path.join(month_folder, HISTORY_FOLDER, r["file"])
+            for r in read_history_manifest(month_folder)["revisioni"]]
+
+# Lettura dello storico in forma codificata: i dizionari delle partizioni confluiscono in
+# un'unica tabella dei codici senza convertire le celle in stringhe
+def read_history_encoded(month_folder):
+    files = _history_files(month_folder)
+    if not files:
+        return None
+    dataset = ds.dataset(files, format="parquet")
+    giorni = sorted({f.name for f in dataset.schema if f.name.isdigit()}, key=int)
+    codici = {"": 0}
+    nomi, hashes, blocchi = [], [], []
+    for fragment in dataset.get_fragments():
+        # Solo nome, hash e giorni: le altre colonne della partizione non vengono lette
+        colonne = [c for c in ["Nome", "__HASH__"] + giorni if c in fragment.physical_schema.names]
+        with timed("parquet lettura"):
+            table = fragment.to_table(schema=fragment.physical_schema, columns=colonne)
+        blocco = np.zeros((table.num_rows, len(giorni)), dtype=np.int16)
+        for j, giorno in enumerate(giorni):
+            if giorno not in table.column_names:
+                continue
+            col = table.column(giorno).combine_chunks()
+            if not pa.types.is_dictionary(col.type):
+                col = col.dictionary_encode()
+            remap = np.array([codici.setdefault(v or "", len(codici)) for v in col.dictionary.to_pylist()] + [0],
+                             dtype=np.int16)
+            blocco[:, j] = remap[col.indices.fill_null(len(col.dictionary)).to_numpy()]
+        blocchi.append(blocco)
+        nomi.append(table.column("Nome").to_numpy(zero_copy_only=False))
+        hashes.append(table.column("__HASH__").to_numpy(zero_copy_only=False))
+    return {
+        "nomi": np.concatenate(nomi),
+        "hash": np.concatenate(hashes),
+        "giorni": giorni,
+        "codici": np.array(list(codici), dtype=object),
+        "codice": codici,
+        "matrice": np.concatenate(blocchi),
+    }
 
-def generate_ics_files(translated_df, month, year):
-    ics_files = {}
-    month_number = datetime.strptime(month, "%B").month
-    special_events = {"R1", "R2", "FER", "R0", "OFF", "FEST"}
-    for nome in translated_df["Nome"].unique():
-        cal = Calendar()
-        cal.creator = "Analisi Griglia PDF"
-        cal.timezone = TZ.zone
-        person_shifts = translated_df[translated_df["Nome"] == nome]
-        for _, row in person_shifts.iterrows():
-            for day_str in [c for c in translated_df.columns if c != "Nome" and c.isdigit()]:
-                day = int(day_str)
-                value = row[day_str]
-                if not value or pd.isna(value):
-                    continue
-                try:
-                    naive_date = datetime(year, month_number, day)
-                    aware_date = TZ.localize(naive_date)
-                    if value in special_events:
-                        event = Event(name=value, begin=aware_date.replace(hour=0, minute=1), end=aware_date.replace(hour=23, minute=59))
-                    elif "(" in value and ")" in value:
-                        start_time, duration = value.split(" (")
-                        duration = int(duration.replace(")", ""))
-                        start_h, start_m = map(int, start_time.split(":"))
-                        begin = aware_date.replace(hour=start_h, minute=start_m)
-                        event = Event(name=f"Turno: {start_time} ({duration}h)", begin=begin, end=begin + timedelta(hours=duration))
-                    cal.events.add(event)
-                except Exception as e:
-                    print(f"Errore creazione evento: {str(e)}")
-        nome_file = f"{nome.replace(' ', '_')}_{month.lower()}.ics"
-        file_path = os.path.join(ICS_FOLDER, f"{nome.lower()}_{month.lower()}.ics")
-
-        with open(file_path, "w") as f:
-            f.writelines(cal.serialize_iter())
-        ics_files[nome] = file_path
-    return ics_files
+# Tabelle HTML identiche a DataFrame.to_html(classes=TABLE_CLASSES, index=False, border=0),
+# scritte direttamente per le griglie di stringhe; altri tipi di cella passano da pandas
+TABLE_CLASSES = "table table-sm table-bordered"
+_HTML_CELL = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+def _html_cell(value):
+    if isinstance(value, str):
+        return value.translate(_HTML_CELL).strip()
+    if value is None:
+        return "None"
+    if isinstance(value, float) and value != value:
+        return "NaN"
+    raise TypeError
+
+# `evidenzia`: maschera booleana (righe x colonne) delle celle da segnalare, ignorata se si passa da pandas
+def render_table_html(df, evidenzia=None):
+    if df.columns.nlevels > 1 or not (df.columns.name is None or isinstance(df.columns.name, str) and df.columns.name):
+        return df.to_html(classes=TABLE_CLASSES, index=False, border=0)
+    try:
+        # Con il nome delle colonne (es. "Giorno") pandas aggiunge una prima colonna di intestazione vuota
+        header = "" if df.columns.name is None else f"      <th>{_html_cell(str(df.columns.name))}</th>\n"
+        header += "".join(f"      <th>{_html_cell(str(c))}</th>\n" for c in df.columns)
+        row_start = "    <tr>\n" if df.columns.name is None else "    <tr>\n      <th></th>\n"
+        values = df.to_numpy(dtype=object).tolist()
+        if evidenzia is None:
+            rows = [row_start + "".join(f"      <td>{_html_cell(v)}</td>\n" for v in row) + "    </tr>\n"
+                    for row in values]
+        else:
+            rows = [row_start + "".join(f'      <td class="table-warning">{_html_cell(v)}</td>\n' if segnata
+                                        else f"      <td>{_html_cell(v)}</td>\n" for v, segnata in zip(row, segnate))
+                    + "    </tr>\n" for row, segnate in zip(values, evidenzia.tolist())]
+    except TypeError:
+        return df.to_html(classes=TABLE_CLASSES, index=False, border=0)
+    return (f'<table class="dataframe {TABLE_CLASSES}">\n  <thead>\n    <tr style="text-align: right;">\n'
+            f"{header}    </tr>\n  </thead>\n  <tbody>\n{''.join(rows)}  </tbody>\n</table>")
+
+# Tabelle personali, memorizzate nella voce del mese (rinnovate quando il mese viene ricaricato)
+def person_table_html(roster, nome_norm, tabella):
+    key = (nome_norm, tabella)
+    html = roster["html"].get(key)
+    if html is None:
+        if tabella == "originale":
+            df = roster["originale"].iloc[roster["per_nome_originale"].get(nome_norm, [])]
+        else:
+            df = roster_rows(roster, roster["per_nome"][nome_norm])
+        html = roster["html"].setdefault(key, render_table_html(df))
+    return html
+
+# Salvataggio turni nel database del mese
+def store_roster(pdf_hash, df_originale, translated_df, mese, anno):
+    return store_roster_revisions(mese, anno, [(pdf_hash, df_originale, translated_df)])[-1]
+
+# Più revisioni [(hash, originale, tradotta)] dello stesso mese con una sola scrittura della cartella:
+# i CSV correnti sono quelli dell'ultima revisione
+def store_roster_revisions(mese, anno, revisioni):
+    month_folder = os.path.join(DB_FOLDER, f"{mese}-{anno}")
+    os.makedirs(month_folder, exist_ok=True)
+
+    tradotte = []
+    for pdf_hash, _, translated_df in revisioni:
+        translated_df = translated_df.drop(columns="__HASH__", errors="ignore")
+        translated_df["__HASH__"] = pdf_hash
+        tradotte.append(translated_df)
+    df_originale = revisioni[-1][1]
+    with month_lock(month_folder):
+        for nome_file, df in (("dataframe_tradotto.csv", tradotte[-1].drop(columns="__HASH__")),
+                              ("dataframe_originale.csv", df_originale)):
+            path = os.path.join(month_folder, nome_file)
+            tmp_path = _tmp_path(path)
+            df.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, path)
+        righe = _append_history_revisions(month_folder, [(r[0], df) for r, df in zip(revisioni, tradotte)])
+    invalidate_roster(mese, anno)
+    update_month_catalog(f"{mese}-{anno}", righe)
+    return tradotte
+
+# Normalizzazione dei nomi per le ricerche
+def normalize_name(nome):
+    return nome.strip().upper()
+
+def _file_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# Indice valore -> posizioni delle righe, nell'ordine del file
+def _positions_by_value(values):
+    index = {}
+    for pos, value in enumerate(values):
+        if isinstance(value, str):
+            index.setdefault(value, []).append(pos)
+    return index
+
+# Inizio (minuti, -1 se non è un turno) e durata (ore) di ogni codice
+def shift_code_times(codici):
+    inizio = np.full(len(codici), -1, dtype=np.int16)
+    durata = np.zeros(len(codici), dtype=np.int16)
+    for i, valore in enumerate(codici):
+        match = SHIFT_VALUE_RE.match(valore)
+        if match:
+            ore, minuti, durata[i] = map(int, match.groups())
+            inizio[i] = ore * 60 + minuti
+    return inizio, durata
+
+def load_roster(month_folder, original_csv_path):
+    roster = read_history_encoded(month_folder)
+    df_originale = pd.read_csv(original_csv_path) if os.path.exists(original_csv_path) else None
+
+    per_nome = _positions_by_value(normalize_name(n) if isinstance(n, str) else n for n in roster["nomi"])
+    inizio, durata = shift_code_times(roster["codici"])
+    roster.update(
+        originale=df_originale,
+        per_nome=per_nome,
+        per_nome_originale={} if df_originale is None else _positions_by_value(
+            normalize_name(n) if isinstance(n, str) else n for n in df_originale.iloc[:, 0]),
+        # Indice per la ricerca dei cambi: ultima revisione di ogni persona e orari per codice
+        correnti=np.array([positions[-1] for positions in per_nome.values()], dtype=np.intp),
+        nomi_norm=np.array([normalize_name(n) if isinstance(n, str) else n for n in roster["nomi"]], dtype=object),
+        inizio=inizio,
+        durata=durata,
+        esclusi=np.array([c in SWAP_EXCLUDED_CODES for c in roster["codici"]]),
+        html={},  # (nome, tabella) -> HTML già generato
+    )
+    return roster
+
+# Righe dello storico decodificate in DataFrame (Nome, giorni, __HASH__) per la visualizzazione
+def roster_rows(roster, positions):
+    df = pd.DataFrame(roster["codici"][roster["matrice"][positions]], columns=roster["giorni"])
+    df.insert(0, "Nome", roster["nomi"][positions])
+    df["__HASH__"] = roster["hash"][positions]
+    return df
+
+# Differenze di una nuova tabella tradotta rispetto all'ultima riga di ogni persona nello storico:
+# restituisce il riepilogo {"modificati": {nome: [giorni]}, "aggiunti", "rimossi", "celle"} e la
+# maschera delle celle cambiate, allineata a translated_df (righe x colonne)
+def diff_roster(roster, translated_df):
+    giorni = [c for c in translated_df.columns if c in roster["giorni"]]
+    colonne = [translated_df.columns.get_loc(c) for c in giorni]
+    indici = [roster["giorni"].index(c) for c in giorni]
+    nomi = translated_df["Nome"].to_numpy(dtype=object)
+    nomi_norm = [normalize_name(n) if isinstance(n, str) else n for n in nomi]
+    maschera = np.zeros(translated_df.shape, dtype=bool)
+
+    # Celle nuove come codici dello storico; i codici mai visti (-1) risultano sempre cambiati
+    valori = translated_df[giorni].to_numpy(dtype=object).ravel()
+    codici = np.array([roster["codice"].get(v if isinstance(v, str) else "", -1) for v in valori],
+                      dtype=np.int16).reshape(len(translated_df), len(giorni))
+    presenti = np.array([n in roster["per_nome"] for n in nomi_norm], dtype=bool)
+    righe = np.flatnonzero(presenti)
+    posizioni = np.array([roster["per_nome"][nomi_norm[i]][-1] for i in righe], dtype=np.intp)
+    cambiate = codici[righe] != roster["matrice"][posizioni][:, indici]
+    maschera[np.ix_(righe, colonne)] = cambiate
+
+    # Persone nuove: evidenziati i turni assegnati
+    nuove = np.flatnonzero(~presenti)
+    maschera[np.ix_(nuove, colonne)] = codici[nuove] != 0
+
+    modificati = {nomi[i]: [giorni[j] for j in np.flatnonzero(riga)]
+                  for i, riga in zip(righe, cambiate) if riga.any()}
+    ultima = roster["hash"][-1]
+    nomi_nuovi = set(nomi_norm)
+    rimossi = sorted({n for n, h, nn in zip(roster["nomi"], roster["hash"], roster["nomi_norm"])
+                      if h == ultima and nn not in nomi_nuovi})
+    riepilogo = {"modificati": modificati, "aggiunti": [nomi[i] for i in nuove], "rimossi": rimossi,
+                 "celle": int(maschera.sum())}
+    return riepilogo, maschera
+
+# Candidati al cambio di un turno (data, inizio "HH:MM", durata in ore) su più mesi.
+# modalita: "esatto" stesso inizio e stessa durata, "compatibile" inizio entro tolleranza_minuti,
+# "sovrapposto" fasce orarie che si intersecano; in queste ultime due la durata può scostarsi di tolleranza_ore.
+# Si cercano i giorni entro `finestra` dalla data, usando l'ultima revisione di ogni persona;
+# restituisce None se nessun mese della finestra è nel database.
+def find_swap_candidates(data, orario, durata, finestra=0, modalita="esatto",
+                         tolleranza_minuti=0, tolleranza_ore=0, escludi_nome=None, limite=None):
+    if modalita not in SWAP_MODES:
+        raise ValueError(f"Modalità non valida: {modalita}")
+    if not 0 <= finestra <= SWAP_MAX_WINDOW:
+        raise ValueError(f"La finestra deve essere tra 0 e {SWAP_MAX_WINDOW} giorni")
+    if tolleranza_minuti < 0 or tolleranza_ore < 0:
+        raise ValueError("Le tolleranze non possono essere negative")
+    ore, minuti = map(int, orario.split(":"))
+    inizio = ore * 60 + minuti
+    durata = int(durata)
+    data = datetime(data.year, data.month, data.day)
+
+    # Giorni della finestra raggruppati per mese
+    per_mese = {}
+    for scarto in range(-finestra, finestra + 1):
+        giorno = data + timedelta(days=scarto)
+        per_mese.setdefault((giorno.strftime("%B"), str(giorno.year)), []).append(
+            (giorno.strftime("%Y-%m-%d"), giorno.day, scarto))
+
+    # Persone in riposo/ferie nel giorno richiesto
+    esclusi = {normalize_name(escludi_nome)} if escludi_nome else set()
+    roster = get_roster(data.strftime("%B"), str(data.year))
+    if roster is not None and str(data.day) in roster["giorni"]:
+        colonna = roster["matrice"][roster["correnti"], roster["giorni"].index(str(data.day))]
+        esclusi.update(roster["nomi_norm"][roster["correnti"][roster["esclusi"][colonna]]])
+
+    trovati = []
+    for (mese, anno), giorni in per_mese.items():
+        roster = get_roster(mese, anno)
+        if roster is None:
+            continue
+        giorni = [g for g in giorni if str(g[1]) in roster["giorni"]]
+        colonne = [roster["giorni"].index(str(g[1])) for g in giorni]
+        correnti = roster["correnti"][[n not in esclusi for n in roster["nomi_norm"][roster["correnti"]]]]
+        blocco = roster["matrice"][np.ix_(correnti, colonne)]
+        inizi = roster["inizio"][blocco].astype(np.int32)
+        durate = roster["durata"][blocco].astype(np.int32)
+
+        ok = (inizi >= 0) & (np.abs(durate - durata) <= tolleranza_ore)
+        if modalita == "esatto":
+            ok &= (inizi == inizio) & (durate == durata)
+        elif modalita == "compatibile":
+            ok &= np.abs(inizi - inizio) <= tolleranza_minuti
+        else:
+            ok &= (inizi < inizio + durata * 60) & (inizi + durate * 60 > inizio)
+
+        righe, col = np.nonzero(ok)
+        scarti = np.array([g[2] for g in giorni], dtype=np.int32)[col]
+        trovati.append((roster, giorni, correnti[righe], col, blocco[righe, col], scarti,
+                        inizi[righe, col] - inizio, durate[righe, col] - durata))
+
+    if not trovati:
+        return None
+
+    # Ordinamento per punteggio (poi per data) su tutti i mesi, dizionari solo per i primi `limite`
+    scarti = np.concatenate([t[5] for t in trovati])
+    scarti_minuti = np.concatenate([t[6] for t in trovati])
+    scarti_ore = np.concatenate([t[7] for t in trovati])
+    punteggi = np.abs(scarti) * SWAP_DAY_PENALTY + np.abs(scarti_minuti) + np.abs(scarti_ore) * SWAP_HOUR_PENALTY
+    ordine = np.lexsort((scarti, punteggi))[:limite]
+
+    inizio_mesi = np.cumsum([0] + [len(t[5]) for t in trovati])
+    mesi_ordine = np.searchsorted(inizio_mesi, ordine, side="right") - 1
+    candidati = []
+    for i, k, j in zip(ordine.tolist(), mesi_ordine.tolist(), (ordine - inizio_mesi[mesi_ordine]).tolist()):
+        roster, giorni, posizioni, colonne, codici = trovati[k][:5]
+        candidati.append({
+            "nome": roster["nomi"][posizioni[j]],
+            "data": giorni[colonne[j]][0],
+            "turno": roster["codici"][codici[j]],
+            "scarto_giorni": int(scarti[i]),
+            "scarto_minuti": int(scarti_minuti[i]),
+            "scarto_ore": int(scarti_ore[i]),
+            "punteggio": int(punteggi[i]),
+        })
+    return candidati
+
+# Turni del mese in forma codificata con indice per nome; ricaricati se i file cambiano
+def get_roster(mese, anno):
+    key = f"{mese}-{anno}"
+    folder = os.path.join(DB_FOLDER, key)
+    original_csv_path = os.path.join(folder, "dataframe_originale.csv")
+
+    ensure_history(folder)
+    mtimes = (_file_mtime(history_manifest_path(folder)), _file_mtime(original_csv_path))
+    if mtimes[0] is None:
+        return None
+    with ROSTER_LOCK:
+        entry = ROSTER_STORE.get(key)
+    if entry is not None and entry["mtimes"] == mtimes:
+        return entry
+
+    entry = load_roster(folder, original_csv_path)
+    entry["mtimes"] = mtimes
+    with ROSTER_LOCK:
+        ROSTER_STORE[key] = entry
+    return entry
+
+def invalidate_roster(mese, anno):
+    with ROSTER_LOCK:
+        ROSTER_STORE.pop(f"{mese}-{anno}", None)
+
+# Catalogo mesi: righe per mese, aggiornato a ogni caricamento
+def catalog_path():
+    return os.path.join(DB_FOLDER, CATALOG_FILE)
+
+# Lock del catalogo tra processi (web e `flask importa-turni`, più worker gunicorn)
+def catalog_lock():
+    return file_lock(os.path.join(DB_FOLDER, f".{CATALOG_FILE}.lock"))
+
+def write_month_catalog(mesi):
+    path = catalog_path()
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, "w") as f:
+        json.dump(mesi, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Ricostruzione dai manifest dello storico (solo se il catalogo manca)
+def rebuild_month_catalog():
+    mesi = {}
+    for m in os.listdir(DB_FOLDER):
+        folder = os.path.join(DB_FOLDER, m)
+        if not os.path.isdir(folder):
+            continue
+        ensure_history(folder)
+        revisioni = read_history_manifest(folder)["revisioni"]
+        if revisioni:
+            mesi[m] = sum(r["righe"] for r in revisioni)
+    write_month_catalog(mesi)
+    return mesi
+
+def _catalog_version():
+    return catalog_path(), _file_mtime(catalog_path())
+
+def _current_month_catalog():
+    version = _catalog_version()
+    if version[1] is None:
+        with catalog_lock():
+            mesi = rebuild_month_catalog() if _file_mtime(catalog_path()) is None else _read_month_catalog()
+    elif version != MONTH_CATALOG["versione"]:
+        mesi = _read_month_catalog()
+    else:
+        return dict(MONTH_CATALOG["mesi"])
+    MONTH_CATALOG.update(versione=_catalog_version(), mesi=mesi)
+    return dict(mesi)
+
+def load_month_catalog():
+    with CATALOG_LOCK:
+        return _current_month_catalog()
+
+def _read_month_catalog():
+    with open(catalog_path()) as f:
+        return json.load(f)
+
+def update_month_catalog(mese_anno, righe):
+    with CATALOG_LOCK, catalog_lock():
+        # Letto dal disco sotto il lock: un altro processo può averlo appena aggiornato
+        mesi = _read_month_catalog() if _file_mtime(catalog_path()) is not None else rebuild_month_catalog()
+        mesi[mese_anno] = righe
+        write_month_catalog(mesi)
+        MONTH_CATALOG.update(versione=_catalog_version(), mesi=mesi)
+
+# Pool di processi per il lavoro CPU (pdfplumber trattiene il GIL)
+def get_process_pool():
+    global _process_pool
+    with _POOLS_LOCK:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=max(JOB_WORKERS, PDF_WORKERS),
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+def get_job_executor():
+    global _job_executor
+    with _POOLS_LOCK:
+        if _job_executor is None:
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+        return _job_executor
+
+# Estrazione (pagine nel pool di processi) e traduzione
+def parse_roster_pdf(pdf_path, progress=None):
+    df_originale = extract_table_from_pdf(pdf_path, progress=progress)
+    if df_originale is None or df_originale.empty:
+        raise ValueError("Nessuna tabella trovata nel PDF")
+
+    mese, anno = extract_month_year_from_table(df_originale)
+    if not mese or not anno:
+        raise ValueError("Impossibile determinare mese/anno")
+
+    with timed("traduzione"):
+        translated_df = translate_shifts(df_originale, mese, anno)
+    return df_originale, mese, anno, translated_df
+
+def update_job(job_id, **fields):
+    with JOBS_LOCK:
+        JOBS[job_id].update(fields, aggiornato=time.time())
+        _save_job(JOBS[job_id])
+
+# Stato del lavoro su disco (con JOBS_DIR), da chiamare con JOBS_LOCK
+def _save_job(job):
+    if JOBS_DIR:
+        path = os.path.join(JOBS_DIR, f"{job['id']}.json")
+        tmp_path = _tmp_path(path)
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+# Stato di un lavoro: dalla memoria o, se di un altro worker, da JOBS_DIR
+def get_job(job_id):
+    with JOBS_LOCK:
+        if job_id in JOBS:
+            return dict(JOBS[job_id])
+    if JOBS_DIR and JOB_ID_RE.fullmatch(job_id):
+        try:
+            with open(os.path.join(JOBS_DIR, f"{job_id}.json")) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+    return None
+
+# Accodamento di un PDF caricato: restituisce l'id del lavoro o None se la coda è piena
+# (`nuovo`: il PDF è stato aggiunto all'archivio da questo caricamento)
+def submit_upload_job(pdf_path, pdf_hash, nuovo=False):
+    # Ricerca, prenotazione del posto e registrazione in un'unica sezione: due caricamenti
+    # identici contemporanei condividono lo stesso lavoro
+    with JOBS_LOCK:
+        existing = ACTIVE_JOBS_BY_HASH.get(pdf_hash)
+        if existing is not None:
+            return existing
+        if not JOB_SLOTS.acquire(blocking=False):
+            return None
+        job_id = uuid.uuid4().hex
+        JOBS[job_id] = {"id": job_id, "stato": "in coda", "progresso": 0, "errore": None,
+                        "creato": time.time(), "aggiornato": time.time()}
+        ACTIVE_JOBS_BY_HASH[pdf_hash] = job_id
+        _save_job(JOBS[job_id])
+    get_job_executor().submit(run_upload_job, job_id, pdf_path, pdf_hash, nuovo)
+    return job_id
+
+def run_upload_job(job_id, pdf_path, pdf_hash, nuovo=False):
+    elaborato = False
+    try:
+        update_job(job_id, stato="estrazione", progresso=10)
+        cached = load_parse_cache(pdf_hash)
+        if cached is not None:
+            # PDF già elaborato: nessuna nuova estrazione
+            df_originale = cached["df_originale"]
+            translated_df = cached["translated_df"]
+            mese, anno = cached["mese"], cached["anno"]
+        else:
+            def page_progress(done, total):
+                update_job(job_id, progresso=10 + int(50 * done / total))
+            df_originale, mese, anno, translated_df = parse_roster_pdf(pdf_path, progress=page_progress)
+        elaborato = True
+
+        # Una revisione già nello storico non viene salvata di nuovo: CSV correnti, roster in memoria
+        # e catalogo restano quelli dell'ultima revisione (come in `flask importa-turni`)
+        manifest = read_history_manifest(os.path.join(DB_FOLDER, f"{mese}-{anno}"))
+        modifiche, maschera = None, None
+        if pdf_hash in {r["hash"] for r in manifest["revisioni"]}:
+            modifiche = {"gia_caricata": True}
+            translated_df = translated_df.drop(columns="__HASH__", errors="ignore")
+            translated_df["__HASH__"] = pdf_hash
+        else:
+            # Confronto con i turni già presenti del mese, prima di aggiungere la revisione
+            precedente = get_roster(mese, str(anno))
+            if precedente is not None:
+                modifiche, maschera = diff_roster(precedente, translated_df)
+            update_job(job_id, stato="salvataggio", progresso=70)
+            translated_df = store_roster(pdf_hash, df_originale, translated_df, mese, anno)
+
+        # Tabelle complete generate una sola volta per PDF
+        tabelle = cached.get("tabelle") if cached is not None else None
+        if tabelle is None:
+            tabelle = {"original_table": render_table_html(df_originale),
+                       "translated_table": render_table_html(translated_df)}
+            store_parse_cache(pdf_hash, {
+                "mese": mese,
+                "anno": anno,
+                "df_originale": df_originale,
+                "translated_df": translated_df,
+                "tabelle": tabelle,
+            })
+
+        risultato = dict(tabelle, mese=mese, anno=anno, modifiche=modifiche)
+        if maschera is not None and modifiche["celle"]:
+            # Solo questa vista segnala le celle cambiate: le tabelle in cache restano quelle del PDF
+            maschera = np.hstack([maschera, np.zeros((len(maschera), translated_df.shape[1] - maschera.shape[1]), bool)])
+            risultato["translated_table"] = render_table_html(translated_df, evidenzia=maschera)
+        TEMPORARY_STORAGE.set(job_id, risultato)
+        update_job(job_id, stato="completato", progresso=100)
 
+    except Exception as e:
+        update_job(job_id, stato="errore", errore=f"Errore durante l'elaborazione: {str(e)}")
+        # PDF non leggibile aggiunto da questo caricamento: non resta nell'archivio. Un PDF già
+        # presente (forse una revisione nello storico) o un errore dopo l'estrazione non lo rimuovono
+        if nuovo and not elaborato:
+            with JOBS_LOCK:
+                if os.path.exists(pdf_path):
+                    os.remove(pdf_path)
+    finally:
+        with JOBS_LOCK:
+            ACTIVE_JOBS_BY_HASH.pop(pdf_hash, None)
+        JOB_SLOTS.release()
+
+# Elaborazione di un PDF nel pool dell'importazione: risultato e secondi impiegati
+def parse_roster_file(pdf_path):
+    start = time.perf_counter()
+    df_originale, mese, anno, translated_df = parse_roster_pdf(pdf_path)
+    return df_originale, mese, anno, translated_df, time.perf_counter() - start
+
+# Hash del contenuto (lo stesso dei caricamenti) e controllo della firma PDF
+def pdf_file_hash(path):
+    hasher = hashlib.md5()
+    with open(path, "rb") as f:
+        header = f.read(PDF_HEADER_WINDOW)
+        if PDF_MAGIC not in header:
+            raise UnsupportedMediaType("Il file non è un PDF")
+        hasher.update(header)
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# Copia nell'archivio PDF, se non c'è già un file con lo stesso hash; True se il file è stato copiato
+def archive_pdf(path, pdf_hash):
+    pdf_path = pdf_store_path(pdf_hash)
+    if os.path.exists(pdf_path):
+        return False
+    tmp_path = _tmp_path(pdf_path)
+    shutil.copyfile(path, tmp_path)
+    os.replace(tmp_path, pdf_path)
+    return True
+
+# Importazione di una cartella di turni: estrazione e traduzione nel pool di processi,
+# poi una sola scrittura per mese
+@app.cli.command("importa-turni")
+@click.argument("cartella", type=click.Path(exists=True, file_okay=False))
+@click.option("--processi", type=int, default=PDF_WORKERS, show_default=True, help="PDF elaborati in parallelo")
+def import_rosters(cartella, processi):
+    """Importa nello storico tutti i PDF dei turni contenuti in CARTELLA."""
+    start = time.perf_counter()
+    esiti = {}       # file -> (esito, mese-anno, secondi)
+    da_elaborare = {}  # hash -> file
+    copiati = set()    # hash dei PDF aggiunti all'archivio da questa importazione
+    for nome in sorted(os.listdir(cartella)):
+        path = os.path.join(cartella, nome)
+        if not (os.path.isfile(path) and nome.lower().endswith(".pdf")):
+            continue
+        try:
+            pdf_hash = pdf_file_hash(path)
+        except (OSError, UnsupportedMediaType) as e:
+            esiti[nome] = (f"errore: {getattr(e, 'description', e)}", "", 0.0)
+            continue
+        if pdf_hash in da_elaborare:
+            esiti[nome] = (f"duplicato di {os.path.basename(da_elaborare[pdf_hash])}", "", 0.0)
+            continue
+        da_elaborare[pdf_hash] = path
+        if archive_pdf(path, pdf_hash):
+            copiati.add(pdf_hash)
+
+    # Estrazione: i PDF già elaborati vengono dalla cache, gli altri dal pool
+    elaborati = {}   # hash -> (originale, mese, anno, tradotta)
+    futures = {}
+    with ProcessPoolExecutor(max_workers=max(1, processi), mp_context=multiprocessing.get_context("spawn")) as pool:
+        for pdf_hash, path in da_elaborare.items():
+            cached = load_parse_cache(pdf_hash)
+            if cached is not None:
+                elaborati[pdf_hash] = (cached["df_originale"], cached["mese"], cached["anno"], cached["translated_df"])
+                esiti[os.path.basename(path)] = ("dalla cache", f"{cached['mese']}-{cached['anno']}", 0.0)
+            else:
+                futures[pool.submit(parse_roster_file, pdf_store_path(pdf_hash))] = pdf_hash
+        for future in as_completed(futures):
+            pdf_hash = futures[future]
+            nome = os.path.basename(da_elaborare[pdf_hash])
+            try:
+                df_originale, mese, anno, translated_df, secondi = future.result()
+            except Exception as e:
+                esiti[nome] = (f"errore: {e}", "", 0.0)
+                # Solo i PDF copiati ora: quelli già in archivio possono essere revisioni dello storico
+                if pdf_hash in copiati and os.path.exists(pdf_store_path(pdf_hash)):
+                    os.remove(pdf_store_path(pdf_hash))
+                continue
+            elaborati[pdf_hash] = (df_originale, mese, anno, translated_df)
+            esiti[nome] = ("elaborato", f"{mese}-{anno}", secondi)
+            store_parse_cache(pdf_hash, {"mese": mese, "anno": anno,
+                                         "df_originale": df_originale, "translated_df": translated_df})
+
+    # Scrittura: revisioni nuove raggruppate per mese, nell'ordine dei nomi dei file
+    per_mese = {}
+    for pdf_hash, path in da_elaborare.items():
+        if pdf_hash not in elaborati:
+            continue
+        df_originale, mese, anno, translated_df = elaborati[pdf_hash]
+        presenti = per_mese.get((mese, anno))
+        if presenti is None:
+            manifest = read_history_manifest(os.path.join(DB_FOLDER, f"{mese}-{anno}"))
+            presenti = per_mese[(mese, anno)] = ({r["hash"] for r in manifest["revisioni"]}, [])
+        if pdf_hash in presenti[0]:
+            esiti[os.path.basename(path)] = ("già nello storico",) + esiti[os.path.basename(path)][1:]
+        else:
+            presenti[1].append((pdf_hash, df_originale, translated_df))
+    scritture = {}
+    for (mese, anno), (_, revisioni) in per_mese.items():
+        if revisioni:
+            inizio_scrittura = time.perf_counter()
+            store_roster_revisions(mese, anno, revisioni)
+            scritture[f"{mese}-{anno}"] = (len(revisioni), time.perf_counter() - inizio_scrittura)
+
+    for nome, (esito, mese_anno, secondi) in sorted(esiti.items()):
+        click.echo(f"{nome:<40} {mese_anno:<16} {secondi:7.2f} s  {esito}")
+    for mese_anno, (revisioni, secondi) in sorted(scritture.items()):
+        click.echo(f"{mese_anno:<40} {revisioni:3d} revisioni  {secondi:7.2f} s  scritto")
+    errori = sum(esito.startswith("errore") for esito, _, _ in esiti.values())
+    importati = sum(revisioni for revisioni, _ in scritture.values())
+    click.echo(f"{len(esiti)} file, {importati} revisioni importate in {len(scritture)} mesi, {errori} errori, "
+               f"{time.perf_counter() - start:.1f} s")
+    if errori:
+        raise SystemExit(1)
+
+
+# Tempo di ogni richiesta per endpoint e profilo cProfile su richiesta
+@app.before_request
+def start_request_timer():
+    g.inizio_richiesta = time.perf_counter()
+    token = request.headers.get("X-Profile")
+    if PROFILE_TOKEN and token and hmac.compare_digest(token, PROFILE_TOKEN):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+            g.profilo = profiler
+        except ValueError:  # un altro profilo è già attivo
+            pass
+
+@app.after_request
+def stop_request_timer(response):
+    profiler = g.pop("profilo", None)
+    if profiler is not None:
+        profiler.disable()
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        path = os.path.join(PROFILE_FOLDER, f"{datetime.now():%Y%m%d-%H%M%S}-{request.endpoint}-{uuid.uuid4().hex[:8]}.prof")
+        profiler.dump_stats(path)
+        response.headers["X-Profile-File"] = path
+    if "inizio_richiesta" in g:
+        observe(f"richiesta {request.endpoint}", time.perf_counter() - g.inizio_richiesta)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    # Se la vista solleva un'eccezione after_request non viene eseguito
+    profiler = g.pop("profilo", None)
+    if profiler is not None:
+        profiler.disable()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault("inizio_template", []).append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    starts = g.get("inizio_template")
+    if starts:
+        observe(f"template {template.name}", time.perf_counter() - starts.pop())
+
+def _metric_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+@app.route("/metrics")
+def metrics():
+    with METRICS_LOCK:
+        snapshot = {stage: (list(h["bucket"]), h["somma"], h["conteggio"]) for stage, h in METRICS.items()}
+    lines = ["# HELP appweb_stage_seconds Durata delle fasi di elaborazione e delle richieste",
+             "# TYPE appweb_stage_seconds histogram"]
+    for stage, (buckets, somma, conteggio) in sorted(snapshot.items()):
+        label = _metric_label(stage)
+        cumulative = 0
+        for le, n in zip(METRICS_BUCKETS, buckets):
+            cumulative += n
+            lines.append(f'appweb_stage_seconds_bucket{{stage="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'appweb_stage_seconds_bucket{{stage="{label}",le="+Inf"}} {conteggio}')
+        lines.append(f'appweb_stage_seconds_sum{{stage="{label}"}} {somma:.6f}')
+        lines.append(f'appweb_stage_seconds_count{{stage="{label}"}} {conteggio}')
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
 
 # Pagina principale
 @app.route("/", methods=["GET", "POST"])
@@ -185,29 +1674,25 @@ def upload():
 
             folder = os.path.join(DB_FOLDER, f"{mese}-{anno}")
             df_path = os.path.join(folder, "dataframe_tradotto.csv")
-            parquet_path = os.path.join(folder, "storico.parquet")
             original_csv_path = os.path.join(folder, "dataframe_originale.csv")
+            ensure_history(folder)
 
 
              # Verifica esistenza dei file
-            if not (os.path.exists(df_path) and os.path.exists(parquet_path) and os.path.exists(original_csv_path)):
+            if not (os.path.exists(df_path) and os.path.exists(history_manifest_path(folder)) and os.path.exists(original_csv_path)):
                 return "Database non trovato o incompleto"
 
-            # Carica i dati
-            df_originale = pd.read_csv(original_csv_path)
-            df_tradotto = pd.read_parquet(parquet_path)
+            # Carica i dati (dalla memoria se già letti)
+            roster = get_roster(mese, anno)
 
             # Verifica nome utente
-            nomi_presenti = df_tradotto["Nome"].str.strip().str.lower().unique()
-            if nome.lower() not in nomi_presenti:
+            nome_norm = normalize_name(nome)
+            if nome_norm not in roster["per_nome"]:
                 return render_template("result_personale.html", error="Non sei autorizzato ad accedere ai dati", utente=nome)
 
-            # Estrai la riga originale e tradotta
-            riga_orig = df_originale[df_originale.iloc[:, 0].str.strip().str.lower() == nome.lower()]
-            riga_trad = df_tradotto[df_tradotto["Nome"].str.strip().str.lower() == nome.lower()]
-
-            originale = riga_orig.to_html(classes='table table-sm table-bordered', index=False, border=0)
-            tradotta = riga_trad.to_html(classes='table table-sm table-bordered', index=False, border=0)
+            # Righe originale e tradotta (HTML generato una volta per revisione del mese)
+            originale = person_table_html(roster, nome_norm, "originale")
+            tradotta = person_table_html(roster, nome_norm, "tradotta")
 
             return render_template("result_personale.html",
                                    utente=nome,
@@ -216,129 +1701,131 @@ def upload():
                                    mese=mese,
                                    anno=anno)
 
-        # Caricamento nuovo PDF
+        # Caricamento nuovo PDF: elaborazione in background
         file = request.files["file"]
         if not file or file.filename == '':
             return "Nessun file selezionato"
-        pdf_path = os.path.join(UPLOAD_FOLDER, file.filename)
-        file.save(pdf_path)
-
-        try:
-            df_originale = extract_table_from_pdf(pdf_path)
-            if df_originale is None or df_originale.empty:
-                return "Nessuna tabella trovata nel PDF"
-
-            mese, anno = extract_month_year_from_table(df_originale)
-            if not mese or not anno:
-                return "Impossibile determinare mese/anno"
-
-            translated_df = translate_shifts(df_originale, mese, anno)
-            pdf_hash = file_hash(pdf_path)
-            month_folder = os.path.join(DB_FOLDER, f"{mese}-{anno}")
-            os.makedirs(month_folder, exist_ok=True)
-
-            new_pdf_path = os.path.join(month_folder, f"originale_{pdf_hash}.pdf")
-            if not os.path.exists(new_pdf_path):
-                os.rename(pdf_path, new_pdf_path)
-            else:
-                os.remove(pdf_path)
-
-            translated_df.to_csv(os.path.join(month_folder, "dataframe_tradotto.csv"), index=False)
-            df_originale.to_csv(os.path.join(month_folder, "dataframe_originale.csv"), index=False)
-
-            db_path = os.path.join(month_folder, "storico.parquet")
-            translated_df["__HASH__"] = pdf_hash
-            if os.path.exists(db_path):
-                existing_df = pd.read_parquet(db_path)
-                if pdf_hash not in existing_df["__HASH__"].values:
-                    updated_df = pd.concat([existing_df, translated_df], ignore_index=True)
-                    updated_df.to_parquet(db_path, index=False)
-            else:
-                translated_df.to_parquet(db_path, index=False)
-
-            ics_files = generate_ics_files(translated_df, mese, anno)
-
-            return render_template("result.html",
-                                   tabella_originale=df_originale.to_html(classes='table table-sm table-bordered', index=False, border=0),
-                                   tabella_tradotta=translated_df.to_html(classes='table table-sm table-bordered', index=False, border=0),
-                                   mese=mese,
-                                   anno=anno)
-
-        except Exception as e:
-            return f"Errore durante l'elaborazione: {str(e)}"
+        pdf_path, pdf_hash = file.stream.commit()
+
+        job_id = submit_upload_job(pdf_path, pdf_hash, nuovo=file.stream.nuovo)
+        if job_id is None:
+            # Coda piena: un PDF aggiunto all'archivio da questo caricamento non vi resta
+            if file.stream.nuovo:
+                with JOBS_LOCK:
+                    if os.path.exists(pdf_path):
+                        os.remove(pdf_path)
+            return "Troppi caricamenti in corso, riprova tra qualche istante", 503
+
+        session['current_session'] = job_id
+        if request.accept_mimetypes.best == "application/json":
+            return jsonify(job_id=job_id, stato_url=url_for("job_status", job_id=job_id)), 202
+        return render_template("job_status.html", job_id=job_id), 202
 
     # GET: pagina iniziale
-    mesi_disponibili = []
-    if os.path.exists(DB_FOLDER):
-        mesi_disponibili = sorted(
-            [(m, len(pd.read_parquet(os.path.join(DB_FOLDER, m, 'storico.parquet'))))
-             for m in os.listdir(DB_FOLDER)
-             if os.path.exists(os.path.join(DB_FOLDER, m, 'storico.parquet'))],
-            key=lambda x: x[0], reverse=True
-        )
+    mesi_disponibili = sorted(load_month_catalog().items(), key=lambda x: x[0], reverse=True)
     return render_template("upload.html", mesi=mesi_disponibili)
 
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(e):
+    return f"File troppo grande (massimo {MAX_UPLOAD_MB} MB)", 413
+
+@app.errorhandler(UnsupportedMediaType)
+def upload_not_pdf(e):
+    return e.description, 415
+
 @app.route("/download/<nome>/<mese>")
 def download_ics_personale(nome, mese):
+    anno = request.args.get("anno")
+    nome_norm = normalize_name(nome)
     filename = f"{nome.lower()}_{mese.lower()}.ics"
-    file_path = os.path.join(ICS_FOLDER, filename)
 
-    if not os.path.exists(file_path):
-        return f"File {filename} non trovato nella cartella calendars.", 404
+    # Mesi corrispondenti, dal più recente
+    candidati = sorted((k.split("-") for k in load_month_catalog()
+                        if k.split("-")[0].lower() == mese.lower() and (not anno or k.split("-")[1] == anno)),
+                       key=lambda k: k[1], reverse=True)
+    for nome_mese, anno_mese in candidati:
+        roster = get_roster(nome_mese, anno_mese)
+        if roster is not None and nome_norm in roster["per_nome"]:
+            path, etag = get_person_ics(roster, nome_norm, nome_mese, anno_mese)
+            # ETag/Last-Modified: i client che interrogano l'URL ricevono 304 se nulla è cambiato
+            return send_file(os.path.abspath(path), as_attachment=True, download_name=filename,
+                             mimetype="text/calendar", etag=etag)
 
-    return send_file(file_path, as_attachment=True)
+    return f"File {filename} non trovato nella cartella calendars.", 404
 
 
 @app.route("/result")
 def result():
     session_id = session.get('current_session')
-    if not session_id or session_id not in TEMPORARY_STORAGE:
+    data = TEMPORARY_STORAGE.get(session_id) if session_id else None
+    if data is None:
         return redirect(url_for("upload"))
-    data = TEMPORARY_STORAGE[session_id]
     return render_template("result.html",
-                           original_table=data['original_table'],
-                           translated_table=data['translated_table'],
-                           ics_files=data['ics_files'],
+                           tabella_originale=data['original_table'],
+                           tabella_tradotta=data['translated_table'],
+                           modifiche=data.get('modifiche'),
                            mese=data['mese'],
                            anno=data['anno'])
 
+# Contatori della cache dei risultati
+@app.route("/cache-stats")
+def cache_stats():
+    return jsonify(TEMPORARY_STORAGE.stats())
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify(errore="Lavoro non trovato"), 404
+    if job["stato"] == "completato":
+        job["risultato_url"] = url_for("result")
+    return jsonify(job)
+
+# Campo intero facoltativo del form (vuoto = 0)
+def form_int(campo):
+    valore = request.form.get(campo) or "0"
+    try:
+        return int(valore)
+    except ValueError:
+        raise ValueError(f"Valore non valido per {campo.replace('_', ' ')}: {valore}") from None
+
 @app.route("/cambio-turno", methods=["GET", "POST"])
 def cambio_turno():
     if request.method == "POST":
         giorno = request.form.get("giorno")
         orario = request.form.get("orario")
         durata = request.form.get("durata")
+        nome = request.form.get("nome", "").strip()
 
         try:
+            parametri = {
+                "finestra": form_int("finestra"),
+                "modalita": request.form.get("modalita") or "esatto",
+                "tolleranza_minuti": form_int("tolleranza_minuti"),
+                "tolleranza_ore": form_int("tolleranza_ore"),
+            }
             data = datetime.strptime(giorno, "%Y-%m-%d")
-            giorno_col = str(data.day)  # le colonne nel parquet sono '1', '2', ...
-            mese = data.strftime("%B")
-            anno = str(data.year)
-            cartella = os.path.join(DB_FOLDER, f"{mese}-{anno}")
-            path_parquet = os.path.join(cartella, "storico.parquet")
-
-            if not os.path.exists(path_parquet):
-                return render_template("cambio_turno.html", messaggio="Nessun database disponibile per quel mese.")
+            candidati = find_swap_candidates(data, orario, durata, escludi_nome=nome or None,
+                                             limite=SWAP_RESULT_LIMIT, **parametri)
 
-            df = pd.read_parquet(path_parquet)
+            if candidati is None:
+                return render_template("cambio_turno.html", messaggio="Nessun database disponibile per quel mese.",
+                                       nome=nome, richiesta=request.form)
 
-            if giorno_col not in df.columns:
-                return render_template("cambio_turno.html", messaggio=f"Giorno {giorno_col} non presente nei dati.")
-
-            valore_turno = f"{orario} ({durata})"
-            disponibili = df[df[giorno_col] == valore_turno]["Nome"].tolist()
-
-            if disponibili:
-                messaggio = f"Sono disponibili per cambio turno: {', '.join(disponibili)}"
+            if candidati:
+                nomi = list(dict.fromkeys(c["nome"] for c in candidati))
+                messaggio = f"Sono disponibili per cambio turno: {', '.join(nomi)}"
             else:
                 messaggio = "Nessuno ha un turno compatibile per il cambio richiesto."
 
-            return render_template("cambio_turno.html", messaggio=messaggio)
+            return render_template("cambio_turno.html", messaggio=messaggio, candidati=candidati,
+                                   nome=nome, richiesta=request.form)
 
         except Exception as e:
-            return render_template("cambio_turno.html", messaggio=f"Errore: {str(e)}")
+            return render_template("cambio_turno.html", messaggio=f"Errore: {str(e)}",
+                                   nome=nome, richiesta=request.form)
 
-    return render_template("cambio_turno.html")
+    return render_template("cambio_turno.html", nome=request.args.get("nome", ""), richiesta={})
 
 @app.route("/result-personale", methods=["GET"])
 def result_personale():
@@ -349,20 +1836,15 @@ def result_personale():
     if not nome or not mese or not anno:
         return "Parametri mancanti"
 
-    folder = os.path.join(DB_FOLDER, f"{mese}-{anno}")
-    parquet_path = os.path.join(folder, "storico.parquet")
-
-    if not os.path.exists(parquet_path):
+    roster = get_roster(mese, anno)
+    if roster is None:
         return "Database non trovato"
 
-    df_tradotto = pd.read_parquet(parquet_path)
-
-    nome_norm = nome.strip().upper()
-    if nome_norm not in df_tradotto["Nome"].str.strip().str.upper().unique():
+    nome_norm = normalize_name(nome)
+    if nome_norm not in roster["per_nome"]:
         return render_template("result_personale.html", error="Non sei autorizzato ad accedere ai dati", utente=nome)
 
-    riga_trad = df_tradotto[df_tradotto["Nome"].str.strip().str.upper() == nome_norm]
-    tradotta = riga_trad.to_html(classes="table table-sm table-bordered", index=False, border=0)
+    tradotta = person_table_html(roster, nome_norm, "tradotta")
 
     return render_template("result_personale.html",
                            utente=nome,
@@ -378,17 +1860,11 @@ def flight_info_integrato():
         return render_template("flight_error.html", messaggio="Inserisci il numero del volo commerciale.")
 
     # 1️⃣ Ricerca su FlightRadar1
-    url = "https://flight-radar1.p.rapidapi.com/flights/search"
-    headers = {
-        "x-rapidapi-key": "db837ae358msh61f8796d5b31c86p1931e4jsn4ccd24caeeaf",
-        "x-rapidapi-host": "flight-radar1.p.rapidapi.com"
-    }
+    url = f"{FLIGHTRADAR1_URL}/flights/search"
     params = {"query": flight_code, "limit": "25"}
 
     try:
-        res = requests.get(url, headers=headers, params=params)
-        res.raise_for_status()
-        data = res.json()
+        data = fetch_json(url, rapidapi_headers(FLIGHTRADAR1_URL), params, ttl=FLIGHT_SEARCH_TTL)
 
         matching = None
         for f in data.get("results", []):
@@ -413,26 +1889,10 @@ def flight_info_integrato():
     except Exception as e:
         return render_template("flight_error.html", messaggio=f"Errore nella ricerca FlightRadar1: {e}")
 
-    # 2️⃣ Ricerca su AircraftScatter
-    url_scatter = "https://aircraftscatter.p.rapidapi.com/lat/41.800278/lon/12.238889/"
-    headers_scatter = {
-        "X-RapidAPI-Key": "db837ae358msh61f8796d5b31c86p1931e4jsn4ccd24caeeaf",
-        "X-RapidAPI-Host": "aircraftscatter.p.rapidapi.com"
-    }
-
+    # 2️⃣ Ricerca nell'istantanea AircraftScatter (aggiornata in background)
     try:
-        res2 = requests.get(url_scatter, headers=headers_scatter)
-        res2.raise_for_status()
-        data2 = res2.json()
-
-        aircraft_list = data2.get("ac", [])
-        matching_ac = None
-
-        for ac in aircraft_list:
-            flight_op = ac.get("flight", "").strip().upper()
-            if flight_op == callsign:
-                matching_ac = ac
-                break
+        per_callsign, eta_dati = get_scatter_snapshot()
+        matching_ac = per_callsign.get(callsign)
 
         if not matching_ac:
             return render_template("flight_error.html",
@@ -452,90 +1912,58 @@ def flight_info_integrato():
                                altitude=altitude,
                                speed=speed,
                                aircraft_type=aircraft_type,
-                               logo=logo_url)
+                               logo=logo_url,
+                               eta_dati=int(eta_dati),
+                               dati_vecchi=eta_dati > SCATTER_STALE_AFTER)
 
     except Exception as e:
         return render_template("flight_error.html", messaggio=f"Errore nella richiesta AircraftScatter: {e}")
 
-def format_epoch(epoch):
-    """Converte un timestamp Unix in formato HH:MM"""
-    dt = datetime.fromtimestamp(epoch)
-    return dt.strftime("%H:%M")
-    
 @app.route("/arrivals-list")
 def arrivals_list():
-    url = "https://fligtradar24-data.p.rapidapi.com/v1/airports/arrivals"
-    params = {"limit": "40", "page": "1", "code": "fco"}
-    headers = {
-        "x-rapidapi-key": "db837ae358msh61f8796d5b31c86p1931e4jsn4ccd24caeeaf",
-        "x-rapidapi-host": "fligtradar24-data.p.rapidapi.com"
-    }
-    
-    def format_epoch(epoch_time):
-        try:
-            return datetime.fromtimestamp(epoch_time).strftime("%H:%M")
-        except:
-            return "N/D"
-
     try:
-        res = requests.get(url, headers=headers, params=params)
-        print("Status code:", res.status_code)
-        res.raise_for_status()
-        data = res.json()
-
-        # parsing sicuro
-        airport_data = data.get("data", {}).get("airport")
-        if not airport_data:
-            raise ValueError("❌ 'airport' mancante nella risposta")
-
-        plugin_data = airport_data.get("pluginData", {})
-        arrivals_data = plugin_data.get("schedule", {}).get("arrivals", {})
-        arrivi_raw = arrivals_data.get("data", [])
-
-        print(f"Numero arrivi ricevuti: {len(arrivi_raw)}")
-
-        arrivi = []
-        for item in arrivi_raw:
-            flight = item.get("flight", {})
-
-            flight_number = (flight.get("identification") or {}).get("number", {}).get("default", "N/D")
-            compagnia = (flight.get("airline") or {}).get("name", "N/D")
-            provenienza = (flight.get("airport") or {}).get("origin", {}).get("position", {}).get("region", {}).get("city", "N/D")
-            logo = (flight.get("owner") or {}).get("logo", "")
-
-            stato_testo = (flight.get("status") or {}).get("text", "N/D")
-            colore = (flight.get("status") or {}).get("icon", "grey")
-
-            time_data = flight.get("time", {})
-            orario_sched_arr_epoch = time_data.get("scheduled", {}).get("arrival")
-            orario_sched_arr = format_epoch(orario_sched_arr_epoch) if orario_sched_arr_epoch else "N/D"
-
-            orario_real_arr_epoch = time_data.get("real", {}).get("arrival")
-            orario_real_arr = format_epoch(orario_real_arr_epoch) if orario_real_arr_epoch else "N/D"
-
-            terminal = (flight.get("airport") or {}).get("destination", {}).get("info", {}).get("terminal", "N/D")
-
-            if flight_number and flight_number != "N/D":
-                arrivi.append({
-                    "compagnia": compagnia,
-                    "flight_number": flight_number,
-                    "provenienza": provenienza,
-                    "orario_sched_arr": orario_sched_arr,
-                    "orario_real_arr": orario_real_arr,
-                    "stato_testo": stato_testo,
-                    "colore": colore,
-                    "logo": logo,
-                    "terminal": terminal
-                })
-
-        if not arrivi:
-            return render_template("flight_error.html", messaggio="Nessun arrivo disponibile al momento.")
-
-        return render_template("arrivals-list.html", arrivi=arrivi)
-
+        arrivi, versione = get_arrivals()
     except Exception as e:
         print(f"❌ ERRORE nella richiesta API: {e}")
         return render_template("flight_error.html", messaggio="Impossibile recuperare i dati degli arrivi.")
 
+    if not arrivi:
+        return render_template("flight_error.html", messaggio="Nessun arrivo disponibile al momento.")
+
+    return render_template("arrivals-list.html", arrivi=arrivi, versione=versione)
+
+# Aggiornamenti del tabellone arrivi in Server-Sent Events
+@app.route("/arrivals-stream")
+def arrivals_stream():
+    ensure_arrivals_poller()
+    ultima = request.headers.get("Last-Event-ID") or request.args.get("versione", "")
+    coda = queue.Queue(maxsize=32)
+    with ARRIVALS_LOCK:
+        ARRIVALS_SUBSCRIBERS.add(coda)
+        versione = ARRIVALS_STATE["versione"]
+        if versione and ultima != str(versione):
+            coda.put_nowait({"versione": versione, "completo": True,
+                             "aggiunti": ARRIVALS_STATE["arrivi"], "modificati": [], "rimossi": [],
+                             "ordine": [a["id"] for a in ARRIVALS_STATE["arrivi"]]})
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    evento = coda.get(timeout=ARRIVALS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if evento is None:
+                    break
+                yield f"id: {evento['versione']}\nevent: arrivi\ndata: {json.dumps(evento)}\n\n"
+        finally:
+            with ARRIVALS_LOCK:
+                ARRIVALS_SUBSCRIBERS.discard(coda)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,792 @@
+"""Benchmark delle fasi di elaborazione dei turni.
+
+Uso:
+    python benchmark.py traduzione [--persone 300] [--ripetizioni 20]
+    python benchmark.py catalogo [--mesi 24] [--revisioni 3] [--persone 300]
+    python benchmark.py ics [--persone 300] [--mese July]
+    python benchmark.py storico [--revisioni 30] [--persone 300]
+    python benchmark.py codifica [--mesi 12] [--revisioni 3] [--persone 300]
+    python benchmark.py scambi [--persone 300] [--finestra 7]
+    python benchmark.py tabelle [--persone 300]
+    python benchmark.py ricaricamento [--persone 300] [--celle 1 10 100]
+    python benchmark.py suite [--persone 300] [--pagine 4] [--latenza-ms 50] [--json risultati.json]
+                              [--confronta precedente.json]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from calendar import monthrange
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from ics import Calendar, Event
+
+import app
+
+# Codici come appaiono nelle celle estratte dal PDF
+CODICI_GREZZI = ["f15", "e14", "g12", "h16", "d20", "f 13", "h17", "e*9",
+                 "R1", "R2", "FER", "OFF", "FEST", "R0", "h", "", None]
+
+# Tabella grezza con la stessa forma di extract_table_from_pdf()
+def synthetic_roster_frame(persone=300, mese="July", anno=2025, seed=0):
+    rnd = random.Random(seed)
+    num_days = monthrange(anno, datetime.strptime(mese, "%B").month)[1]
+    abbr = {"January": "gen", "February": "feb", "March": "mar", "April": "apr",
+            "May": "mag", "June": "giu", "July": "lug", "August": "ago",
+            "September": "set", "October": "ott", "November": "nov", "December": "dic"}[mese]
+    rows = [[f"Turni {abbr}-{anno}"] + [str(d) for d in range(1, num_days + 1)]]
+    for i in range(persone):
+        rows.append([f"COGNOME{i} NOME{i}, {10000 + i}"] + [rnd.choice(CODICI_GREZZI) for _ in range(num_days)])
+    return pd.DataFrame(rows)
+
+# Implementazione originale (iterrows), riferimento per equivalenza e tempi
+def legacy_translate_shifts(df, month, year):
+    work_hours = {"d": 4, "e": 5, "f": 6, "g": 7, "h": 8}
+    special_events = {"R1", "R2", "FER", "R0", "OFF", "FEST"}
+    month_number = datetime.strptime(month, "%B").month
+    _, num_days = monthrange(year, month_number)
+    days = list(range(1, num_days + 1))
+    pivot_data = {}
+
+    for idx, row in df.iterrows():
+        if idx == 0:
+            continue
+        nome_cell = row.iloc[0]
+        if pd.isna(nome_cell) or not isinstance(nome_cell, str):
+            continue
+        nome = nome_cell.split(",")[0].strip()
+        if nome not in pivot_data:
+            pivot_data[nome] = {str(day): "" for day in days}
+
+        for day in days:
+            if day >= len(row):
+                continue
+            raw_value = str(row.iloc[day]).strip().lower() if (day < len(row) and not pd.isna(row.iloc[day])) else ""
+            clean_value = re.sub(r'[^a-z0-9]', '', raw_value)
+            if not clean_value:
+                continue
+            if clean_value in special_events:
+                pivot_data[nome][str(day)] = clean_value.upper()
+            elif len(clean_value) >= 2 and clean_value[0] in work_hours:
+                prefix = clean_value[0]
+                number_part = re.sub(r'[^0-9]', '', clean_value[1:])
+                if number_part:
+                    try:
+                        start_code = int(number_part)
+                        duration = work_hours[prefix]
+                        start_h = start_code / 2
+                        start_time = f"{int(start_h):02d}:{'00' if start_h % 1 == 0 else '30'}"
+                        pivot_data[nome][str(day)] = f"{start_time} ({duration})"
+                    except:
+                        pivot_data[nome][str(day)] = "Formato non valido"
+                else:
+                    pivot_data[nome][str(day)] = clean_value.upper()
+            else:
+                pivot_data[nome][str(day)] = clean_value.upper()
+
+    translated_df = pd.DataFrame.from_dict(pivot_data, orient="index")
+    translated_df.columns.name = "Giorno"
+    translated_df.index.name = "Nome"
+    translated_df.reset_index(inplace=True)
+    cols = ["Nome"] + [str(day) for day in days]
+    return translated_df[cols].fillna("")
+
+# Tempo medio in millisecondi
+def timeit_ms(func, ripetizioni):
+    start = time.perf_counter()
+    for _ in range(ripetizioni):
+        func()
+    return (time.perf_counter() - start) * 1000 / ripetizioni
+
+
+def bench_traduzione(args):
+    df = synthetic_roster_frame(args.persone, seed=args.seed)
+    atteso = legacy_translate_shifts(df, "July", 2025)
+    ottenuto = app.translate_shifts(df, "July", 2025)
+    pd.testing.assert_frame_equal(atteso, ottenuto)
+    print(f"translate_shifts: {args.persone} persone x 31 giorni, output identico all'originale")
+
+    legacy_ms = timeit_ms(lambda: legacy_translate_shifts(df, "July", 2025), args.ripetizioni)
+    new_ms = timeit_ms(lambda: app.translate_shifts(df, "July", 2025), args.ripetizioni)
+    print(f"  originale (iterrows): {legacy_ms:8.2f} ms")
+    print(f"  vettoriale:           {new_ms:8.2f} ms")
+    print(f"  speedup:              {legacy_ms / new_ms:8.1f}x")
+
+
+# Cartella database con `mesi` mesi di storico (revisioni accodate come farebbe store_roster())
+def populate_database(db_folder, mesi=24, revisioni=3, persone=300, anno_iniziale=2023):
+    nomi_mesi = ["January", "February", "March", "April", "May", "June", "July",
+                 "August", "September", "October", "November", "December"]
+    for i in range(mesi):
+        mese, anno = nomi_mesi[i % 12], anno_iniziale + i // 12
+        folder = os.path.join(db_folder, f"{mese}-{anno}")
+        os.makedirs(folder, exist_ok=True)
+        for r in range(revisioni):
+            translated = app.translate_shifts(synthetic_roster_frame(persone, mese, anno, seed=i * 100 + r), mese, anno)
+            pdf_hash = f"{i:04d}{r:028d}"
+            translated["__HASH__"] = pdf_hash
+            with app.month_lock(folder):
+                app._append_history(folder, pdf_hash, translated)
+
+# Versione originale della pagina iniziale: lettura completa dello storico di ogni mese
+def legacy_month_list(db_folder):
+    return sorted(
+        [(m, len(pd.read_parquet(os.path.join(db_folder, m, app.HISTORY_FOLDER))))
+         for m in os.listdir(db_folder)
+         if os.path.isdir(os.path.join(db_folder, m, app.HISTORY_FOLDER))],
+        key=lambda x: x[0], reverse=True
+    )
+
+
+def bench_catalogo(args):
+    with tempfile.TemporaryDirectory() as db_folder:
+        app.DB_FOLDER = db_folder
+        populate_database(db_folder, args.mesi, args.revisioni, args.persone)
+        print(f"catalogo mesi: {args.mesi} mesi x {args.revisioni} revisioni x {args.persone} persone")
+
+        atteso = legacy_month_list(db_folder)
+        rebuild_ms = timeit_ms(lambda: (os.remove(app.catalog_path()) if os.path.exists(app.catalog_path()) else None,
+                                        app.load_month_catalog()), 1)
+        assert sorted(app.load_month_catalog().items(), reverse=True) == atteso
+
+        legacy_ms = timeit_ms(lambda: legacy_month_list(db_folder), args.ripetizioni)
+        warm_ms = timeit_ms(app.load_month_catalog, args.ripetizioni)
+        client = app.app.test_client()
+        page_ms = timeit_ms(lambda: client.get("/"), args.ripetizioni)
+        print(f"  originale (read_parquet di ogni mese): {legacy_ms:8.2f} ms")
+        print(f"  ricostruzione dai manifest:            {rebuild_ms:8.2f} ms (solo se manca catalogo.json)")
+        print(f"  catalogo in memoria:                   {warm_ms:8.3f} ms")
+        print(f"  GET / completa:                        {page_ms:8.2f} ms")
+
+
+# Generazione originale con la libreria ics (un Event per turno, filtro per persona).
+# Unica correzione: le celle che non sono eventi vengono saltate, mentre l'originale
+# riaggiungeva l'ultimo evento creato, anche se apparteneva alla persona precedente.
+def legacy_generate_ics_files(translated_df, month, year, folder):
+    ics_files = {}
+    month_number = datetime.strptime(month, "%B").month
+    special_events = {"R1", "R2", "FER", "R0", "OFF", "FEST"}
+    for nome in translated_df["Nome"].unique():
+        cal = Calendar()
+        cal.creator = "Analisi Griglia PDF"
+        cal.timezone = app.TZ.zone
+        person_shifts = translated_df[translated_df["Nome"] == nome]
+        for _, row in person_shifts.iterrows():
+            for day_str in [c for c in translated_df.columns if c != "Nome" and c.isdigit()]:
+                day = int(day_str)
+                value = row[day_str]
+                if not value or pd.isna(value):
+                    continue
+                try:
+                    naive_date = datetime(year, month_number, day)
+                    aware_date = app.TZ.localize(naive_date)
+                    if value in special_events:
+                        event = Event(name=value, begin=aware_date.replace(hour=0, minute=1), end=aware_date.replace(hour=23, minute=59))
+                    elif "(" in value and ")" in value:
+                        start_time, duration = value.split(" (")
+                        duration = int(duration.replace(")", ""))
+                        start_h, start_m = map(int, start_time.split(":"))
+                        begin = aware_date.replace(hour=start_h, minute=start_m)
+                        event = Event(name=f"Turno: {start_time} ({duration}h)", begin=begin, end=begin + timedelta(hours=duration))
+                    else:
+                        continue
+                    cal.events.add(event)
+                except Exception as e:
+                    print(f"Errore creazione evento: {str(e)}")
+        file_path = os.path.join(folder, f"{nome.lower()}_{month.lower()}.ics")
+        with open(file_path, "w") as f:
+            f.writelines(cal.serialize_iter())
+        ics_files[nome] = file_path
+    return ics_files
+
+def write_ics_files(translated_df, month, year, folder):
+    ics_files = {}
+    for nome, text in app.iter_ics_calendars(translated_df, month, year):
+        file_path = os.path.join(folder, f"{nome.lower()}_{month.lower()}.ics")
+        with open(file_path, "w", newline="") as f:
+            f.write(text)
+        ics_files[nome] = file_path
+    return ics_files
+
+# Eventi di un file ICS come istanti assoluti, per il confronto
+def ics_event_set(path):
+    with open(path, newline="") as f:
+        cal = Calendar(f.read())
+    return {(e.name, e.begin.to("UTC").isoformat(), e.end.to("UTC").isoformat()) for e in cal.events}
+
+
+def bench_ics(args):
+    df = app.translate_shifts(synthetic_roster_frame(args.persone, args.mese, args.anno, seed=args.seed), args.mese, args.anno)
+    with tempfile.TemporaryDirectory() as legacy_dir, tempfile.TemporaryDirectory() as new_dir:
+        legacy_files = legacy_generate_ics_files(df, args.mese, args.anno, legacy_dir)
+        new_files = write_ics_files(df, args.mese, args.anno, new_dir)
+
+        diversi = 0
+        for nome, path in legacy_files.items():
+            attesi, ottenuti = ics_event_set(path), ics_event_set(new_files[nome])
+            diversi += len(attesi ^ ottenuti)
+        print(f"calendari ICS: {args.persone} persone, {args.mese} {args.anno}")
+        if diversi:
+            print(f"  ATTENZIONE: {diversi} eventi diversi dall'originale")
+        else:
+            print("  eventi identici all'originale")
+
+        legacy_ms = timeit_ms(lambda: legacy_generate_ics_files(df, args.mese, args.anno, legacy_dir), args.ripetizioni)
+        new_ms = timeit_ms(lambda: write_ics_files(df, args.mese, args.anno, new_dir), args.ripetizioni)
+        print(f"  originale (libreria ics): {legacy_ms:8.1f} ms")
+        print(f"  scrittura diretta:        {new_ms:8.1f} ms")
+        print(f"  speedup:                  {legacy_ms / new_ms:8.1f}x")
+
+
+# Storico del mese come DataFrame di stringhe (solo le colonne richieste), per i confronti
+def read_history(month_folder, columns=None):
+    files = app._history_files(month_folder)
+    if not files:
+        return None
+    schemas = [pq.read_schema(f) for f in files]
+    schemas = [pa.schema([f.with_type(f.type.value_type) if pa.types.is_dictionary(f.type) else f for f in sch])
+               for sch in schemas]
+    dataset = ds.dataset(files, schema=pa.unify_schemas(schemas), format="parquet")
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+# Scrittura originale dello storico: lettura completa, concatenazione e riscrittura del Parquet
+def legacy_append_history(db_path, pdf_hash, translated_df):
+    translated_df = translated_df.assign(__HASH__=pdf_hash)
+    if os.path.exists(db_path):
+        existing_df = pd.read_parquet(db_path)
+        if pdf_hash not in existing_df["__HASH__"].values:
+            pd.concat([existing_df, translated_df], ignore_index=True).to_parquet(db_path, index=False)
+    else:
+        translated_df.to_parquet(db_path, index=False)
+
+
+def bench_storico(args):
+    revisioni = [app.translate_shifts(synthetic_roster_frame(args.persone, "July", 2025, seed=r), "July", 2025)
+                 for r in range(args.revisioni)]
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "storico.parquet")
+        month_folder = os.path.join(tmp, "July-2025")
+        legacy_ms, new_ms = [], []
+        for r, translated in enumerate(revisioni):
+            pdf_hash = f"{r:032d}"
+            legacy_ms.append(timeit_ms(lambda: legacy_append_history(legacy_path, pdf_hash, translated), 1))
+
+            def append():
+                with app.month_lock(month_folder):
+                    app._append_history(month_folder, pdf_hash, translated.assign(__HASH__=pdf_hash))
+            new_ms.append(timeit_ms(append, 1))
+
+        pd.testing.assert_frame_equal(pd.read_parquet(legacy_path), read_history(month_folder))
+        print(f"storico: {args.revisioni} revisioni x {args.persone} persone, contenuto identico all'originale")
+        print(f"  originale, ultima revisione (riscrittura completa): {legacy_ms[-1]:8.2f} ms")
+        print(f"  partizionato, ultima revisione (solo righe nuove):  {new_ms[-1]:8.2f} ms")
+        print(f"  totale originale / partizionato:                    {sum(legacy_ms):8.1f} / {sum(new_ms):.1f} ms")
+        lettura_ms = timeit_ms(lambda: read_history(month_folder), args.ripetizioni)
+        nomi_ms = timeit_ms(lambda: read_history(month_folder, columns=["Nome", "__HASH__"]), args.ripetizioni)
+        print(f"  lettura completa dal dataset:                       {lettura_ms:8.2f} ms")
+        print(f"  lettura solo Nome/__HASH__:                         {nomi_ms:8.2f} ms")
+
+
+# Persone con un dato turno in un giorno: confronto tra interi sulla colonna del giorno
+def people_with_shift(roster, giorno, valore):
+    codice = roster["codice"].get(valore)
+    if codice is None or giorno not in roster["giorni"]:
+        return []
+    colonna = roster["matrice"][:, roster["giorni"].index(giorno)]
+    return roster["nomi"][np.flatnonzero(colonna == codice)].tolist()
+
+
+def bench_codifica(args):
+    with tempfile.TemporaryDirectory() as db_folder:
+        app.DB_FOLDER = db_folder
+        populate_database(db_folder, args.mesi, args.revisioni, args.persone)
+        mesi = sorted(os.listdir(db_folder))
+        print(f"codifica: {args.mesi} mesi x {args.revisioni} revisioni x {args.persone} persone")
+
+        frames = {m: read_history(os.path.join(db_folder, m)) for m in mesi}
+        rosters = {m: app.read_history_encoded(os.path.join(db_folder, m)) for m in mesi}
+        stringhe_mb = sum(df.memory_usage(deep=True).sum() for df in frames.values()) / 2 ** 20
+        codificati_mb = sum(r["matrice"].nbytes + r["nomi"].nbytes + r["hash"].nbytes +
+                            sum(len(c) for c in r["codici"]) for r in rosters.values()) / 2 ** 20
+        print(f"  DataFrame di stringhe: {stringhe_mb:8.2f} MB")
+        print(f"  codici + matrice int16: {codificati_mb:7.2f} MB (nomi e hash inclusi come riferimenti)")
+
+        # Ricerca del cambio turno su ogni giorno di ogni mese: stringhe contro interi
+        mese = mesi[0]
+        df, roster = frames[mese], rosters[mese]
+        query = [(g, v) for g in roster["giorni"] for v in ("07:30 (6)", "08:00 (8)", "FER")]
+        for giorno, valore in query:
+            assert df[df[giorno] == valore]["Nome"].tolist() == people_with_shift(roster, giorno, valore)
+        legacy_ms = timeit_ms(lambda: [df[df[g] == v]["Nome"].tolist() for g, v in query], args.ripetizioni)
+        new_ms = timeit_ms(lambda: [people_with_shift(roster, g, v) for g, v in query], args.ripetizioni)
+        print(f"  {len(query)} ricerche, confronto tra stringhe: {legacy_ms:8.2f} ms")
+        print(f"  {len(query)} ricerche, confronto tra interi:   {new_ms:8.2f} ms")
+
+
+# Ricerca originale di cambio_turno(): lettura del Parquet del mese e confronto tra stringhe
+def legacy_swap_search(db_folder, data, orario, durata):
+    df = read_history(os.path.join(db_folder, f"{data.strftime('%B')}-{data.year}"))
+    return df[df[str(data.day)] == f"{orario} ({durata})"]["Nome"].tolist()
+
+
+def bench_scambi(args):
+    with tempfile.TemporaryDirectory() as db_folder:
+        app.DB_FOLDER = db_folder
+        populate_database(db_folder, mesi=3, revisioni=1, persone=args.persone)
+        data = datetime(2023, 2, 3)  # finestra a cavallo tra gennaio e febbraio
+        print(f"scambi: 3 mesi x {args.persone} persone, {data:%Y-%m-%d} +/-{args.finestra} giorni")
+
+        for orario, durata in (("07:30", 6), ("08:00", 8), ("17:30", 5)):
+            atteso = legacy_swap_search(db_folder, data, orario, durata)
+            ottenuto = [c["nome"] for c in app.find_swap_candidates(data, orario, durata)]
+            assert sorted(atteso) == sorted(ottenuto), (orario, durata)
+
+        legacy_ms = timeit_ms(lambda: legacy_swap_search(db_folder, data, "07:30", 6), args.ripetizioni)
+        print(f"  originale (un giorno, lettura Parquet):   {legacy_ms:8.2f} ms")
+        app.get_roster("February", "2023")
+        for modalita, extra in (("esatto", {}), ("compatibile", {"tolleranza_minuti": 60, "tolleranza_ore": 1}),
+                                ("sovrapposto", {"tolleranza_ore": 2})):
+            candidati = app.find_swap_candidates(data, "07:30", 6, args.finestra, modalita, **extra)
+            ms = timeit_ms(lambda: app.find_swap_candidates(data, "07:30", 6, args.finestra, modalita,
+                                                            limite=app.SWAP_RESULT_LIMIT, **extra), args.ripetizioni)
+            print(f"  motore, {modalita:<12} {len(candidati):5d} candidati (primi {app.SWAP_RESULT_LIMIT}): {ms:8.2f} ms")
+
+
+# p50 e p99 di una lista di tempi
+def percentili(tempi):
+    tempi = sorted(tempi)
+    return tempi[len(tempi) // 2], tempi[min(len(tempi) - 1, int(len(tempi) * 0.99))]
+
+
+# Percentili in ms di `ripetizioni` chiamate
+def latency_ms(func, ripetizioni):
+    tempi = []
+    for _ in range(ripetizioni):
+        start = time.perf_counter()
+        func()
+        tempi.append((time.perf_counter() - start) * 1000)
+    return percentili(tempi)
+
+
+def bench_tabelle(args):
+    with tempfile.TemporaryDirectory() as db_folder:
+        app.DB_FOLDER = db_folder
+        populate_database(db_folder, mesi=1, revisioni=2, persone=args.persone)
+        mese, anno = "January", "2023"
+        df_originale = synthetic_roster_frame(args.persone, mese, int(anno))
+        translated_df = app.translate_shifts(df_originale, mese, int(anno))
+        opzioni = dict(classes=app.TABLE_CLASSES, index=False, border=0)
+        assert app.render_table_html(df_originale) == df_originale.to_html(**opzioni)
+        assert app.render_table_html(translated_df) == translated_df.to_html(**opzioni)
+        print(f"tabelle: {args.persone} persone, HTML identico a to_html")
+
+        legacy_ms = timeit_ms(lambda: (df_originale.to_html(**opzioni), translated_df.to_html(**opzioni)), 5)
+        new_ms = timeit_ms(lambda: (app.render_table_html(df_originale), app.render_table_html(translated_df)), 5)
+        print(f"  tabelle complete, to_html:             {legacy_ms:8.2f} ms")
+        print(f"  tabelle complete, render_table_html:   {new_ms:8.2f} ms")
+
+        # Pagine: result.html (tabelle dalla cache dei risultati) e result_personale.html
+        client = app.app.test_client()
+        app.TEMPORARY_STORAGE.set("bench", {"original_table": app.render_table_html(df_originale),
+                                            "translated_table": app.render_table_html(translated_df),
+                                            "mese": mese, "anno": anno})
+        with client.session_transaction() as sess:
+            sess["current_session"] = "bench"
+        with app.app.test_request_context():
+            legacy_result = latency_ms(lambda: app.render_template(
+                "result.html", tabella_originale=df_originale.to_html(**opzioni),
+                tabella_tradotta=translated_df.to_html(**opzioni), mese=mese, anno=anno), 20)
+            roster = app.get_roster(mese, anno)
+            posizioni = roster["per_nome"]["COGNOME7 NOME7"]
+            legacy_personale = latency_ms(lambda: app.render_template(
+                "result_personale.html", utente="cognome7 nome7",
+                tradotta=app.roster_rows(roster, posizioni).to_html(**opzioni), mese=mese, anno=anno),
+                args.ripetizioni)
+        new_result = latency_ms(lambda: client.get("/result"), 20)
+        url = f"/result-personale?nome=cognome7 nome7&mese={mese}&anno={anno}"
+        new_personale = latency_ms(lambda: client.get(url), args.ripetizioni)
+        print(f"  result.html, to_html a ogni richiesta:      p50 {legacy_result[0]:7.2f} ms  p99 {legacy_result[1]:7.2f} ms")
+        print(f"  GET /result, HTML in cache:                 p50 {new_result[0]:7.2f} ms  p99 {new_result[1]:7.2f} ms")
+        print(f"  result_personale.html, to_html:             p50 {legacy_personale[0]:7.2f} ms  p99 {legacy_personale[1]:7.2f} ms")
+        print(f"  GET /result-personale, HTML in cache:       p50 {new_personale[0]:7.2f} ms  p99 {new_personale[1]:7.2f} ms")
+
+
+def bench_ricaricamento(args):
+    nomi_mesi = ["January", "February", "March", "April", "May", "June", "July",
+                 "August", "September", "October", "November", "December"]
+    anno = 2025
+    with tempfile.TemporaryDirectory() as db_folder, tempfile.TemporaryDirectory() as ics_folder:
+        app.DB_FOLDER, app.ICS_FOLDER = db_folder, ics_folder
+        print(f"ricaricamento di un mese corretto: {args.persone} persone")
+        for i, celle in enumerate(args.celle):
+            mese = nomi_mesi[i % 12]
+            originale = synthetic_roster_frame(args.persone, mese, anno, seed=i)
+            base = app.translate_shifts(originale, mese, anno)
+            app.store_roster(f"{i:04d}{0:028d}", originale, base, mese, anno)
+            roster = app.get_roster(mese, str(anno))
+            nomi = [app.normalize_name(n) for n in base["Nome"]]
+            for nome in nomi:
+                app.get_person_ics(roster, nome, mese, anno)
+
+            # Revisione corretta: `celle` celle del PDF cambiate a caso, poi tradotte come in un caricamento vero
+            rnd = random.Random(i)
+            originale_corretto = originale.copy()
+            for _ in range(celle):
+                riga, colonna = rnd.randrange(1, len(originale_corretto)), rnd.randrange(1, originale_corretto.shape[1])
+                originale_corretto.iat[riga, colonna] = rnd.choice(CODICI_GREZZI)
+            corretta = app.translate_shifts(originale_corretto, mese, anno)
+
+            with tempfile.TemporaryDirectory() as legacy_dir:
+                legacy_ms = timeit_ms(lambda: write_ics_files(corretta, mese, anno, legacy_dir), 1)
+            start = time.perf_counter()
+            modifiche, _ = app.diff_roster(roster, corretta)
+            diff_ms = (time.perf_counter() - start) * 1000
+            app.store_roster(f"{i:04d}{1:028d}", originale_corretto, corretta, mese, anno)
+            roster = app.get_roster(mese, str(anno))
+            prima = sum(len(files) for _, _, files in os.walk(ics_folder))
+            start = time.perf_counter()
+            for nome in nomi:
+                app.get_person_ics(roster, nome, mese, anno)
+            ics_ms = (time.perf_counter() - start) * 1000
+            rigenerati = sum(len(files) for _, _, files in os.walk(ics_folder)) - prima
+            print(f"  {celle:5d} celle cambiate: {len(modifiche['modificati']):4d} persone, {rigenerati:4d} calendari rigenerati; "
+                  f"tutti i calendari {legacy_ms:7.1f} ms, diff {diff_ms:6.2f} ms + calendari {ics_ms:7.1f} ms")
+
+
+# PDF sintetico con la tabella di synthetic_roster_frame() disegnata a griglia, come il turno reale:
+# intestazione "Turni lug-2025" e giorni sulla prima pagina, colleghi divisi sulle pagine
+def synthetic_roster_pdf(path, persone=300, giorni=None, pagine=1, mese="July", anno=2025, seed=0):
+    frame = synthetic_roster_frame(persone, mese, anno, seed)
+    if giorni is not None:
+        frame = frame.iloc[:, :giorni + 1]
+    rows = frame.fillna("").astype(str).values.tolist()
+    header, people = rows[0], rows[1:]
+    per_page = max(1, -(-len(people) // pagine))
+    col_width, row_height, name_width = 22, 14, 110
+    width = name_width + col_width * (len(header) - 1) + 40
+
+    pages = []
+    for p in range(pagine):
+        page_rows = ([header] if p == 0 else []) + people[p * per_page:(p + 1) * per_page]
+        if not page_rows:
+            break
+        height = row_height * len(page_rows) + 60
+        top = height - 20
+        xs = [20, 20 + name_width] + [20 + name_width + col_width * (k + 1) for k in range(len(header) - 1)]
+        bottom = top - len(page_rows) * row_height
+        ops = ["0.5 w"]
+        ops += [f"{xs[0]} {top - r * row_height} m {xs[-1]} {top - r * row_height} l S" for r in range(len(page_rows) + 1)]
+        ops += [f"{x} {top} m {x} {bottom} l S" for x in xs]
+        for r, row in enumerate(page_rows):
+            y = top - (r + 1) * row_height + 4
+            for c, text in enumerate(row):
+                if text:
+                    text = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+                    ops.append(f"BT /F1 6 Tf {xs[c] + 2} {y} Td ({text}) Tj ET")
+        pages.append(("\n".join(ops).encode(), width, height))
+
+    # Oggetti: 1 catalogo, 2 albero delle pagine, 3 font, poi coppie pagina/contenuto
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    def add(body):
+        offsets.append(len(out))
+        out.extend(f"{len(offsets)} 0 obj\n".encode() + body + b"\nendobj\n")
+    kids = " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+    add(b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, (content, w, h) in enumerate(pages):
+        add(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {w} {h}] /CropBox [0 0 {w} {h}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode())
+        add(f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+    xref = len(out)
+    out.extend(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode())
+    out.extend("".join(f"{o:010d} 00000 n \n" for o in offsets).encode())
+    out.extend(f"trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+# Voli sintetici condivisi dai tre stub: numero commerciale, callsign e posizione
+def synthetic_flights(voli=50, seed=0):
+    rnd = random.Random(seed)
+    now = int(time.time())
+    return [{"numero": f"AZ{1000 + i}", "callsign": f"AZA{1000 + i}",
+             "lat": round(41.8 + rnd.uniform(-1, 1), 4), "lon": round(12.2 + rnd.uniform(-1, 1), 4),
+             "alt": rnd.randrange(2000, 38000, 500), "gs": rnd.randrange(150, 480),
+             "arrivo": now + rnd.randrange(-3600, 3 * 3600)} for i in range(voli)]
+
+
+def stub_flight_search(voli, query):
+    return {"results": [{"label": f"{v['numero']} / {v['callsign']}", "detail": {"logo": ""}}
+                        for v in voli if v["numero"].startswith(query.upper())]}
+
+
+def stub_scatter(voli):
+    return {"ac": [{"flight": f"{v['callsign']}  ", "lat": v["lat"], "lon": v["lon"], "alt_baro": v["alt"],
+                    "gs": v["gs"], "t": "A320"} for v in voli]}
+
+
+def stub_arrivals(voli):
+    data = [{"flight": {
+        "identification": {"number": {"default": v["numero"]}},
+        "time": {"scheduled": {"arrival": v["arrivo"]}, "real": {"arrival": None}},
+        "airline": {"name": "Compagnia di prova"},
+        "airport": {"origin": {"position": {"region": {"city": "Milano"}}}},
+        "status": {"text": "Scheduled", "icon": "green"},
+        "owner": {"logo": ""},
+    }} for v in voli]
+    return {"data": {"airport": {"pluginData": {"schedule": {"arrivals": {"data": data}}}}}}
+
+
+# Server HTTP locale che risponde come un endpoint RapidAPI dopo `latenza` secondi
+def start_stub_server(risposta, latenza):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            time.sleep(latenza)
+            body = json.dumps(risposta(url.path, parse_qs(url.query))).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Stub di FlightRadar1, AircraftScatter e FlightRadar24 al posto degli URL RapidAPI dell'app
+def start_flight_stubs(voli, latenza):
+    stubs = {
+        "FLIGHTRADAR1_URL": lambda path, query: stub_flight_search(voli, query.get("query", [""])[0]),
+        "AIRCRAFTSCATTER_URL": lambda path, query: stub_scatter(voli),
+        "FLIGHTRADAR24_URL": lambda path, query: stub_arrivals(voli),
+    }
+    servers, nomi = [], {}
+    for attr, risposta in stubs.items():
+        server, url = start_stub_server(risposta, latenza)
+        setattr(app, attr, url)
+        servers.append(server)
+        nomi[f"api {urlsplit(url).netloc}"] = f"api {attr[:-4].lower()} (stub)"
+    return servers, nomi
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_suite(args):
+    mese, anno = args.mese, args.anno
+    giorni = args.giorni or monthrange(anno, datetime.strptime(mese, "%B").month)[1]
+    voli = synthetic_flights(args.voli)
+    route = {}
+    fasi = {}
+
+    # Campioni grezzi delle fasi strumentate nell'app (gli istogrammi di /metrics restano invariati)
+    observe = app.observe
+    def observe_campione(stage, seconds):
+        fasi.setdefault(stage, []).append(seconds * 1000)
+        observe(stage, seconds)
+    app.observe = observe_campione
+
+    def richiesta(nome, metodo, url, **kwargs):
+        start = time.perf_counter()
+        res = getattr(client, metodo)(url, **kwargs)
+        route.setdefault(nome, []).append((time.perf_counter() - start) * 1000)
+        assert res.status_code < 400, f"{nome}: HTTP {res.status_code}"
+        return res
+
+    cwd = os.getcwd()
+    servers, nomi_stub = start_flight_stubs(voli, args.latenza_ms / 1000)
+    with tempfile.TemporaryDirectory() as base:
+        # Le cartelle dell'app sono relative alla directory corrente
+        os.chdir(base)
+        try:
+            for folder in (app.ICS_FOLDER, app.DB_FOLDER, app.CACHE_FOLDER, app.PDF_FOLDER):
+                os.makedirs(folder, exist_ok=True)
+            pdfs = []
+            for i in range(args.caricamenti):
+                path = os.path.join(base, f"turni_{i}.pdf")
+                synthetic_roster_pdf(path, args.persone, giorni, args.pagine, mese, anno, seed=i)
+                pdfs.append(path)
+            print(f"suite: {args.caricamenti} PDF da {args.persone} persone x {giorni} giorni su {args.pagine} pagine, "
+                  f"{args.voli} voli, latenza stub {args.latenza_ms:.0f} ms, commit {git_commit() or 'N/D'}")
+
+            client = app.app.test_client()
+            start_suite = time.perf_counter()
+
+            # Caricamenti: PDF diversi (pipeline completa) e lo stesso PDF di nuovo (cache di parsing)
+            for path in pdfs + pdfs[:1]:
+                with open(path, "rb") as f:
+                    contenuto = f.read()
+                start = time.perf_counter()
+                res = richiesta("POST / (caricamento)", "post", "/", content_type="multipart/form-data",
+                                data={"file": (io.BytesIO(contenuto), os.path.basename(path))},
+                                headers={"Accept": "application/json"})
+                while True:
+                    job = richiesta("GET /jobs/<id>", "get", res.json["stato_url"]).json
+                    if job["stato"] in ("completato", "errore"):
+                        break
+                    time.sleep(0.01)
+                assert job["stato"] == "completato", job.get("errore")
+                route.setdefault("caricamento completo (fino a completato)", []).append(
+                    (time.perf_counter() - start) * 1000)
+                richiesta("GET /result", "get", "/result")
+
+            nomi = [f"COGNOME{i} NOME{i}" for i in range(args.persone)]
+            for i in range(args.ripetizioni):
+                nome = nomi[i % len(nomi)]
+                richiesta("GET /", "get", "/")
+                richiesta("POST / (accesso)", "post", "/", data={"access_db": "1", "mese": mese, "anno": str(anno), "nome": nome})
+                richiesta("GET /result-personale", "get", "/result-personale",
+                          query_string={"nome": nome.lower(), "mese": mese, "anno": anno})
+                richiesta("GET /download", "get", f"/download/{nome.lower()}/{mese.lower()}", query_string={"anno": anno})
+                richiesta("GET /cambio-turno", "get", "/cambio-turno", query_string={"nome": nome})
+                richiesta("POST /cambio-turno", "post", "/cambio-turno",
+                          data={"giorno": f"{anno}-{datetime.strptime(mese, '%B').month:02d}-{1 + i % giorni:02d}",
+                                "orario": "07:30", "durata": "6", "finestra": "3", "modalita": "compatibile",
+                                "tolleranza_minuti": "60", "nome": nome})
+                richiesta("POST /flight-info", "post", "/flight-info", data={"flight_number": voli[i % len(voli)]["numero"]})
+                richiesta("GET /arrivals-list", "get", "/arrivals-list")
+                richiesta("GET /metrics", "get", "/metrics")
+            durata_suite = time.perf_counter() - start_suite
+        finally:
+            os.chdir(cwd)
+            app.observe = observe
+            for server in servers:
+                server.shutdown()
+
+    risultati = {
+        "commit": git_commit(),
+        "parametri": {k: v for k, v in vars(args).items() if k not in ("func", "json", "confronta")},
+        "durata_s": durata_suite,
+        "route": {nome: riepilogo(tempi, durata_suite) for nome, tempi in route.items()},
+        # Fasi degli stub con il nome dell'API invece della porta, che cambia a ogni esecuzione
+        "fasi": {nomi_stub.get(nome, nome): riepilogo(tempi, durata_suite) for nome, tempi in fasi.items()},
+    }
+    precedente = None
+    if args.confronta:
+        with open(args.confronta) as f:
+            precedente = json.load(f)
+        print(f"confronto con {args.confronta} (commit {precedente.get('commit') or 'N/D'})")
+    for sezione, titolo in (("route", "Route"), ("fasi", "Fasi")):
+        print(f"\n{titolo:<44} {'n':>5} {'req/s':>8} {'p50 ms':>9} {'p99 ms':>9}")
+        for nome, r in sorted(risultati[sezione].items()):
+            riga = f"  {nome:<42} {r['n']:5d} {r['al_secondo']:8.1f} {r['p50_ms']:9.2f} {r['p99_ms']:9.2f}"
+            prima = (precedente or {}).get(sezione, {}).get(nome)
+            if prima:
+                riga += f"   p50 {variazione(prima['p50_ms'], r['p50_ms'])}  p99 {variazione(prima['p99_ms'], r['p99_ms'])}"
+            print(riga)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(risultati, f, indent=2)
+        print(f"\nrisultati salvati in {args.json}")
+
+
+def riepilogo(tempi, durata_s):
+    p50, p99 = percentili(tempi)
+    return {"n": len(tempi), "al_secondo": len(tempi) / durata_s, "p50_ms": p50, "p99_ms": p99}
+
+
+def variazione(prima, dopo):
+    return f"{(dopo - prima) / prima * 100:+6.1f}%" if prima else "   N/D"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delle fasi di elaborazione dei turni")
+    sub = parser.add_subparsers(dest="benchmark", required=True)
+
+    p = sub.add_parser("traduzione", help="translate_shifts vettoriale contro l'originale")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--ripetizioni", type=int, default=20)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_traduzione)
+
+    p = sub.add_parser("catalogo", help="elenco mesi della pagina iniziale con molti mesi di storico")
+    p.add_argument("--mesi", type=int, default=24)
+    p.add_argument("--revisioni", type=int, default=3)
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--ripetizioni", type=int, default=20)
+    p.set_defaults(func=bench_catalogo)
+
+    p = sub.add_parser("ics", help="calendari ICS di un mese intero, libreria ics contro scrittura diretta")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--mese", default="July")
+    p.add_argument("--anno", type=int, default=2025)
+    p.add_argument("--ripetizioni", type=int, default=3)
+    p.add_argument("--seed", type=int, default=0)
+    p.set_defaults(func=bench_ics)
+
+    p = sub.add_parser("storico", help="aggiunta di revisioni allo storico, riscrittura completa contro partizioni")
+    p.add_argument("--revisioni", type=int, default=30)
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--ripetizioni", type=int, default=10)
+    p.set_defaults(func=bench_storico)
+
+    p = sub.add_parser("codifica", help="memoria e ricerche sullo storico codificato contro DataFrame di stringhe")
+    p.add_argument("--mesi", type=int, default=12)
+    p.add_argument("--revisioni", type=int, default=3)
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--ripetizioni", type=int, default=10)
+    p.set_defaults(func=bench_codifica)
+
+    p = sub.add_parser("scambi", help="ricerca dei cambi turno su più mesi con finestra di giorni")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--finestra", type=int, default=7)
+    p.add_argument("--ripetizioni", type=int, default=50)
+    p.set_defaults(func=bench_scambi)
+
+    p = sub.add_parser("tabelle", help="HTML delle tabelle e latenza di result.html / result_personale.html")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--ripetizioni", type=int, default=200)
+    p.set_defaults(func=bench_tabelle)
+
+    p = sub.add_parser("ricaricamento", help="diff di una revisione corretta e calendari rigenerati solo per chi cambia")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--celle", type=int, nargs="+", default=[1, 10, 100, 1000])
+    p.set_defaults(func=bench_ricaricamento)
+
+    p = sub.add_parser("suite", help="route e fasi della pipeline con PDF sintetici e API di volo simulate in locale")
+    p.add_argument("--persone", type=int, default=300)
+    p.add_argument("--giorni", type=int, default=None, help="colonne giorno nel PDF (default: tutto il mese)")
+    p.add_argument("--pagine", type=int, default=4)
+    p.add_argument("--mese", default="July")
+    p.add_argument("--anno", type=int, default=2025)
+    p.add_argument("--caricamenti", type=int, default=3, help="PDF diversi caricati, più un ricaricamento")
+    p.add_argument("--ripetizioni", type=int, default=50, help="giri sulle route di consultazione")
+    p.add_argument("--voli", type=int, default=50)
+    p.add_argument("--latenza-ms", type=float, default=50, help="latenza degli stub RapidAPI")
+    p.add_argument("--json", help="file in cui salvare i risultati")
+    p.add_argument("--confronta", help="risultati JSON di un'esecuzione precedente")
+    p.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()